@@ -0,0 +1,75 @@
+# Copyright 2023 AI Redefined Inc. <dev+cogment@ai-r.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Compare the throughput of the DQN training step when run eagerly and when compiled as a graph
+# Usage, from the built `dqn_agent` directory: `.venv/bin/python benchmark_train.py`
+
+from replay_buffer import ReplayBuffer, TRANSITION_FIELDS
+from dqn import LAST_MOVES, actions_count, create_model, create_train_step, train_on_batch
+
+import numpy as np
+import tensorflow as tf
+
+import time
+
+batch_size = 100
+gamma = 0.99
+steps_count = 500
+replay_buffer_size = 100000
+
+
+def create_random_replay_buffer():
+    rb = ReplayBuffer(replay_buffer_size)
+    transitions = {key: np.random.randint(len(LAST_MOVES), size=replay_buffer_size) for key in TRANSITION_FIELDS}
+    transitions["action"] = np.random.randint(actions_count, size=replay_buffer_size)
+    transitions["reward"] = np.random.choice([-1.0, 0.0, 1.0], size=replay_buffer_size)
+    rb.add_transitions(transitions)
+    return rb
+
+
+def measure_steps_per_sec(train_step, rb):
+    # Warm up, in particular this triggers the graph compilation
+    train_on_batch(train_step, rb.sample(batch_size))
+
+    start = time.perf_counter()
+    for _ in range(steps_count):
+        train_on_batch(train_step, rb.sample(batch_size))
+    return steps_count / (time.perf_counter() - start)
+
+
+def main():
+    rb = create_random_replay_buffer()
+
+    model = create_model()
+    target_model = create_model()
+    train_step = create_train_step(
+        model,
+        target_model,
+        tf.keras.optimizers.Adam(learning_rate=0.00025, clipnorm=1.0),
+        tf.keras.losses.Huber(),
+        batch_size,
+        gamma,
+    )
+
+    eager_steps_per_sec = measure_steps_per_sec(train_step.python_function, rb)
+    print(f"eager training step: {eager_steps_per_sec:.1f} steps/sec")
+
+    compiled_steps_per_sec = measure_steps_per_sec(train_step, rb)
+    print(f"compiled training step: {compiled_steps_per_sec:.1f} steps/sec")
+
+    print(f"speedup: x{compiled_steps_per_sec / eager_steps_per_sec:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# Copyright 2023 AI Redefined Inc. <dev+cogment@ai-r.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from data_pb2 import ROCK, PAPER, SCISSORS
+
+import numpy as np
+import tensorflow as tf
+
+MOVES = [ROCK, PAPER, SCISSORS]
+NO_LAST_MOVE = len(MOVES)
+LAST_MOVES = [ROCK, PAPER, SCISSORS, NO_LAST_MOVE] # The first round of the game has no information on last move
+actions_count = len(MOVES)
+
+# Every possible state as a (my last move, their last move) pair
+STATES = np.array(
+    [(me_last_move, them_last_move) for me_last_move in range(len(LAST_MOVES)) for them_last_move in range(len(LAST_MOVES))],
+    dtype=np.int32,
+)
+
+# Create the deep Q-Network
+def create_model():
+    in_me_last_move = tf.keras.Input(name="obs_me_last_move", shape=(1))
+    in_them_last_move = tf.keras.Input(name="obs_them_last_move", shape=(1))
+    one_hot_move = tf.keras.layers.experimental.preprocessing.CategoryEncoding(
+        name="one_hot_move",
+        num_tokens=len(LAST_MOVES),
+        output_mode="binary"
+    )
+    one_hot_me_last_move = one_hot_move(in_me_last_move)
+    one_hot_them_last_move = one_hot_move(in_them_last_move)
+    concat_ins = tf.keras.layers.concatenate(
+        [one_hot_me_last_move, one_hot_them_last_move]
+    )
+    hidden_layer = tf.keras.layers.Dense(24, activation="relu")(concat_ins)
+    outs = tf.keras.layers.Dense(actions_count, activation="linear")(hidden_layer)
+    return tf.keras.Model(
+        inputs=[in_me_last_move, in_them_last_move], outputs=outs, name="rps_dqn_policy"
+    )
+
+
+# Extract the last moves of both players from a Cogment observation
+def last_moves_from_observation(observation):
+    me = observation.observation.me
+    them = observation.observation.them
+    return (
+        me.last_move if me.HasField("last_move") else NO_LAST_MOVE,
+        them.last_move if them.HasField("last_move") else NO_LAST_MOVE,
+    )
+
+
+# Convert an array of (my last move, their last move) pairs to an input usable with the model
+def model_ins_from_last_moves(last_moves):
+    return {
+        "obs_me_last_move": last_moves[:, 0:1].astype(np.float32),
+        "obs_them_last_move": last_moves[:, 1:2].astype(np.float32),
+    }
+
+
+# Convert a batch of transitions to an input usable with the model
+def model_ins_from_transitions(transitions, prefix=""):
+    return {
+        "obs_me_last_move": transitions[f"{prefix}obs_me_last_move"].astype(np.float32).reshape(-1, 1),
+        "obs_them_last_move": transitions[f"{prefix}obs_them_last_move"].astype(np.float32).reshape(-1, 1),
+    }
+
+
+# Create the function running one gradient step on a batch of transitions
+# It is compiled as a graph once, the fixed input signature prevents any retracing
+def create_train_step(model, target_model, optimizer, loss_function, batch_size, gamma):
+    obs_spec = tf.TensorSpec(shape=(batch_size, 1), dtype=tf.float32)
+
+    @tf.function(
+        input_signature=[
+            obs_spec,
+            obs_spec,
+            tf.TensorSpec(shape=(batch_size,), dtype=tf.int32),
+            tf.TensorSpec(shape=(batch_size,), dtype=tf.float32),
+            obs_spec,
+            obs_spec,
+        ]
+    )
+    def train_step(
+        obs_me_last_move, obs_them_last_move, action, reward, next_obs_me_last_move, next_obs_them_last_move
+    ):
+        # Compute target q values
+        ## Predict the expected reward for the next observation of each sample
+        ## Use the target model for stability
+        target_actions_q_values = target_model(
+            {"obs_me_last_move": next_obs_me_last_move, "obs_them_last_move": next_obs_them_last_move},
+            training=False,
+        )
+
+        ## target Q value = reward + discount factor * expected future reward
+        target_q_values = reward + gamma * tf.reduce_max(target_actions_q_values, axis=1)
+
+        # Compute estimated q values
+        ## Create masks of the taken actions to later select relevant q values
+        selected_actions_masks = tf.one_hot(action, actions_count)
+
+        with tf.GradientTape() as tape:
+            ## Recompute q values for all the actions at each sample
+            estimated_actions_q_values = model(
+                {"obs_me_last_move": obs_me_last_move, "obs_them_last_move": obs_them_last_move},
+                training=True,
+            )
+
+            ## Apply the masks to get the Q value for taken actions
+            estimated_q_values = tf.reduce_sum(
+                tf.multiply(estimated_actions_q_values, selected_actions_masks), axis=1
+            )
+
+            ## Compute loss between the target Q values and the estimated Q values
+            loss = loss_function(target_q_values, estimated_q_values)
+
+        ## Backpropagation!
+        grads = tape.gradient(loss, model.trainable_variables)
+        optimizer.apply_gradients(zip(grads, model.trainable_variables))
+
+        return loss
+
+    return train_step
+
+
+# Run a training step on a batch sampled from the replay buffer
+def train_on_batch(train_step, batch_rb):
+    model_ins = model_ins_from_transitions(batch_rb)
+    next_model_ins = model_ins_from_transitions(batch_rb, prefix="next_")
+    return train_step(
+        model_ins["obs_me_last_move"],
+        model_ins["obs_them_last_move"],
+        batch_rb["action"].astype(np.int32),
+        batch_rb["reward"],
+        next_model_ins["obs_me_last_move"],
+        next_model_ins["obs_them_last_move"],
+    )
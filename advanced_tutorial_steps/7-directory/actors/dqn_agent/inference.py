@@ -0,0 +1,74 @@
+# Copyright 2023 AI Redefined Inc. <dev+cogment@ai-r.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+import numpy as np
+
+
+class InferenceBatcher:
+    """Gather the Q values requests of all the concurrent actor sessions into batches
+
+    Requests are held until either `max_batch_size` of them are pending or the oldest one waited `max_wait_us`
+    microseconds, a single forward pass is then computed for the whole batch.
+    """
+
+    def __init__(self, predict, max_batch_size=64, max_wait_us=500):
+        # `predict` takes an array of (my last move, their last move) pairs and returns the matching batch of Q values
+        self._predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait_us = max_wait_us
+        self._pending = []
+        self._flush_handle = None
+        self.batches_count = 0
+        self.requests_count = 0
+
+    async def q_values(self, me_last_move, them_last_move):
+        """Retrieve the Q values of every action for the given observation"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((me_last_move, them_last_move, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait_us / 1_000_000, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        pending = self._pending
+        self._pending = []
+        if len(pending) == 0:
+            return
+
+        last_moves = np.array([(me, them) for (me, them, _) in pending], dtype=np.float32)
+        try:
+            q_values = np.asarray(self._predict(last_moves))
+        except Exception as error:
+            for (_, _, future) in pending:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        self.batches_count += 1
+        self.requests_count += len(pending)
+        for (request_idx, (_, _, future)) in enumerate(pending):
+            # The requesting session might have been cancelled in the meantime
+            if not future.done():
+                future.set_result(q_values[request_idx])
@@ -0,0 +1,57 @@
+# Copyright 2023 AI Redefined Inc. <dev+cogment@ai-r.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import queue
+import threading
+import traceback
+
+
+class BackgroundLearner:
+    """Learn from the completed trials in a dedicated thread
+
+    Actor sessions push the transitions of their trial and return immediately, the learning function is called, in
+    order, for every pushed trial from the learner thread. The heavy lifting being done by TensorFlow, which releases
+    the GIL, the asyncio event loop keeps serving the ongoing trials in the meantime.
+    """
+
+    def __init__(self, learn, max_pending_trials=1000):
+        self._learn = learn
+        self._trials_queue = queue.Queue(maxsize=max_pending_trials)
+        self._thread = threading.Thread(target=self._run, name="dqn_learner", daemon=True)
+        self.dropped_trials_count = 0
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._trials_queue.put(None)
+        self._thread.join()
+
+    def push_trial(self, trial_rb):
+        try:
+            self._trials_queue.put_nowait(trial_rb)
+        except queue.Full:
+            # Never block the caller, the learner being behind, dropping some data is acceptable
+            self.dropped_trials_count += 1
+            print(f"learner is lagging behind, dropped_trials_count={self.dropped_trials_count}")
+
+    def _run(self):
+        while True:
+            trial_rb = self._trials_queue.get()
+            if trial_rb is None:
+                break
+            try:
+                self._learn(trial_rb)
+            except Exception:
+                traceback.print_exc()
@@ -13,7 +13,21 @@
 # limitations under the License.
 
 import cog_settings
-from data_pb2 import PlayerAction, ROCK, PAPER, SCISSORS
+from data_pb2 import PlayerAction
+from replay_buffer import ReplayBuffer, TrialRecorder
+from inference import InferenceBatcher
+from learner import BackgroundLearner
+from policy import DoubleBufferedModel, DoubleBufferedPolicy, copy_weights
+from dqn import (
+    MOVES,
+    STATES,
+    actions_count,
+    create_model,
+    create_train_step,
+    last_moves_from_observation,
+    model_ins_from_last_moves,
+    train_on_batch,
+)
 
 import cogment
 import numpy as np
@@ -38,66 +52,34 @@ epsilon_decay_per_tick = (
     epsilon_max - epsilon_min
 ) / 1000.0  # Reach the lowest exploration rate after 1000 ticks
 max_replay_buffer_size = 100000
+train_steps_per_trial = 1  # How many gradient steps are taken at the end of each trial
+weights_publish_interval = 1  # How many trials are learned between each update of the acting model
+q_values_lookup_table = True  # Precompute the Q values of every state, otherwise they are inferred by the acting model
 
-MOVES = [ROCK, PAPER, SCISSORS]
-NO_LAST_MOVE = len(MOVES)
-LAST_MOVES = [ROCK, PAPER, SCISSORS, NO_LAST_MOVE] # The first round of the game has no information on last move
-actions_count = len(MOVES)
-
-# Create the deep Q-Network
-def create_model():
-    in_me_last_move = tf.keras.Input(name="obs_me_last_move", shape=(1))
-    in_them_last_move = tf.keras.Input(name="obs_them_last_move", shape=(1))
-    one_hot_move = tf.keras.layers.experimental.preprocessing.CategoryEncoding(
-        name="one_hot_move",
-        num_tokens=len(LAST_MOVES),
-        output_mode="binary"
-    )
-    one_hot_me_last_move = one_hot_move(in_me_last_move)
-    one_hot_them_last_move = one_hot_move(in_them_last_move)
-    concat_ins = tf.keras.layers.concatenate(
-        [one_hot_me_last_move, one_hot_them_last_move]
-    )
-    hidden_layer = tf.keras.layers.Dense(24, activation="relu")(concat_ins)
-    outs = tf.keras.layers.Dense(actions_count, activation="linear")(hidden_layer)
-    return tf.keras.Model(
-        inputs=[in_me_last_move, in_them_last_move], outputs=outs, name="rps_dqn_policy"
-    )
-
-
-# Convert a Cogment observation to an input usable with the model
-def model_ins_from_observations(observations):
-    return {
-        "obs_me_last_move": np.array([
-            [o.observation.me.last_move if o.observation.me.HasField("last_move") else NO_LAST_MOVE]
-            for o in observations
-        ]),
-        "obs_them_last_move": np.array([
-            [o.observation.them.last_move if o.observation.them.HasField("last_move") else NO_LAST_MOVE]
-            for o in observations
-        ]),
-    }
-
-
-# Create the replay buffer datastructure
-def create_replay_buffer():
-    return {
-        "obs_me_last_move": np.array([]),
-        "obs_them_last_move": np.array([]),
-        "action": np.array([]),
-        "reward": np.array([]),
-        "next_obs_me_last_move": np.array([]),
-        "next_obs_them_last_move": np.array([]),
-    }
-
+# Parameters for the batched inference shared by all the trials, used without the lookup table
+inference_max_batch_size = 64  # Maximum number of observations evaluated in one forward pass
+inference_max_wait_us = 500  # Maximum time an observation waits for other ones to be batched with
 
 # Bunch of global variables, it's generally a bad idea,
 # It works here because we only have one instance of the dqn_agent service.
-_model = create_model()
+# `_policy` is used to select actions, `_learner_model` is trained in the background
+# and periodically published to `_policy`.
+if q_values_lookup_table:
+    _policy = DoubleBufferedPolicy(STATES, model_ins_from_last_moves, actions_count)
+else:
+    _policy = DoubleBufferedModel(create_model)
+_learner_model = create_model()
+_policy.publish(_learner_model)
 _target_model = create_model()
+_train_step = create_train_step(_learner_model, _target_model, optimizer, loss_function, batch_size, gamma)
+_learned_trials_count = 0
 _epsilon = epsilon_max
-_rb = create_replay_buffer()
-_collected_samples_count = 0
+_rb = ReplayBuffer(max_replay_buffer_size)
+_inference_batcher = InferenceBatcher(
+    lambda last_moves: _policy.predict(model_ins_from_last_moves(last_moves)),
+    max_batch_size=inference_max_batch_size,
+    max_wait_us=inference_max_wait_us,
+)
 
 
 def get_and_update_epsilon():
@@ -109,143 +91,88 @@ def get_and_update_epsilon():
 
 
 def append_trial_replay_buffer(trial_rb):
-    global _rb
-    global _collected_samples_count
-
-    trial_rb_size = len(trial_rb["obs_me_last_move"])
-
-    for key in _rb.keys():
-        # Append the trial data to the current vector
-        _rb[key] = np.append(_rb[key], trial_rb[key])
-        # Enfore the size limit by discarding older data
-        if len(_rb[key]) > max_replay_buffer_size:
-            _rb[key] = _rb[key][-max_replay_buffer_size:]
-
-    _collected_samples_count += trial_rb_size
-    rb_size = len(_rb["obs_me_last_move"])
-
-    # Sanity check, all vectors in the replay buffer should have the same size
-    for key in _rb.keys():
-        assert rb_size == len(_rb[key])
+    _rb.add_transitions(trial_rb)
 
     print(
-        f"samples_count={_collected_samples_count}"
+        f"samples_count={_rb.num_total}, policy_version={_policy.version}"
     )
 
 
 def train():
-    global _model
+    global _learner_model
     global _target_model
 
-    rb_size = len(_rb["obs_me_last_move"])
-
-    if rb_size >= batch_size:
+    if _rb.size() >= batch_size:
         # Printing progress by looking at the wins ratio of the last trials
-        last_trials_wins_count = np.count_nonzero(_rb['reward'][-batch_size:] == 1.0)
-        last_trials_losses_count = np.count_nonzero(_rb['reward'][-batch_size:] == -1.0)
+        last_rewards = _rb.latest("reward", batch_size)
+        last_trials_wins_count = np.count_nonzero(last_rewards == 1.0)
+        last_trials_losses_count = np.count_nonzero(last_rewards == -1.0)
         print(f"last_trials_wins_ratio={last_trials_wins_count /(last_trials_wins_count + last_trials_losses_count)}")
 
-        # Step 1 - Randomly select a batch
-        batch_indices = np.random.choice(range(rb_size), size=batch_size)
-        batch_rb = create_replay_buffer()
-        for key in batch_rb.keys():
-            batch_rb[key] = np.take(_rb[key], batch_indices)
-
-        # Step 2 - Compute target q values
-        ## Predict the expected reward for the next observation of each sample
-        ## Use the target model for stability
-        target_actions_q_values = _target_model(
-            {
-                "obs_me_last_move": batch_rb["next_obs_me_last_move"],
-                "obs_them_last_move": batch_rb["next_obs_them_last_move"],
-            }
-        )
-
-        ## target Q value = reward + discount factor * expected future reward
-        target_q_values = batch_rb["reward"] + gamma * tf.reduce_max(
-            target_actions_q_values, axis=1
-        )
-
-        # Step 3 - Compute estimated q values
-        ## Create masks of the taken actions to later select relevant q values
-        selected_actions_masks = tf.one_hot(batch_rb["action"], actions_count)
-
-        with tf.GradientTape() as tape:
-            ## Recompute q values for all the actions at each sample
-            estimated_actions_q_values = _model(
-                {
-                    "obs_me_last_move": batch_rb["obs_me_last_move"],
-                    "obs_them_last_move": batch_rb["obs_them_last_move"],
-                }
-            )
-
-            ## Apply the masks to get the Q value for taken actions
-            estimated_q_values = tf.reduce_sum(
-                tf.multiply(estimated_actions_q_values, selected_actions_masks), axis=1
-            )
-
-            ## Compute loss between the target Q values and the estimated Q values
-            loss = loss_function(target_q_values, estimated_q_values)
-
-            ## Backpropagation!
-            grads = tape.gradient(loss, _model.trainable_variables)
-            optimizer.apply_gradients(zip(grads, _model.trainable_variables))
+        # Randomly select batches and run the compiled training step on them
+        for _ in range(train_steps_per_trial):
+            batch_rb = _rb.sample(batch_size)
+            train_on_batch(_train_step, batch_rb)
 
         # Update the target model
-        if _collected_samples_count % target_model_update_interval == 0:
-            _target_model.set_weights(_model.get_weights())
+        if _rb.num_total % target_model_update_interval == 0:
+            copy_weights(_target_model, _learner_model)
+
+
+# Called from the learner thread for each completed trial
+def learn_from_trial(trial_rb):
+    global _learned_trials_count
+
+    append_trial_replay_buffer(trial_rb)
+    train()
+
+    _learned_trials_count += 1
+    if _learned_trials_count % weights_publish_interval == 0:
+        _policy.publish(_learner_model)
+
+
+_learner = BackgroundLearner(learn_from_trial)
 
 
 async def dqn_agent(actor_session):
     actor_session.start()
 
-    trial_rb = create_replay_buffer()
+    trial_recorder = TrialRecorder()
 
     async for event in actor_session.all_events():
         if event.observation:
-            model_ins = model_ins_from_observations([event.observation])
+            (me_last_move, them_last_move) = last_moves_from_observation(event.observation)
+            trial_recorder.add_observation(me_last_move, them_last_move)
             if event.type == cogment.EventType.ACTIVE:
 
                 if np.random.rand(1)[0] < get_and_update_epsilon():
                     # Take random action
                     action = np.random.choice(actions_count)
+                elif q_values_lookup_table:
+                    # Q values of the latest published model are looked up, no inference needed
+                    q_values = _policy.q_values(me_last_move, them_last_move)
+                    action = np.argmax(q_values)
                 else:
-                    model_outs = _model(model_ins, training=False)
-                    action = tf.math.argmax(model_outs[0]).numpy()
-                actor_session.do_action(PlayerAction(move=action))
-
-                trial_rb["obs_me_last_move"] = np.append(
-                    trial_rb["obs_me_last_move"], model_ins["obs_me_last_move"]
-                )
-                trial_rb["obs_them_last_move"] = np.append(
-                    trial_rb["obs_them_last_move"], model_ins["obs_them_last_move"]
-                )
-                trial_rb["action"] = np.append(trial_rb["action"], [action])
-                trial_rb["reward"] = np.append(trial_rb["reward"], [0.0])
-            else:
-                trial_rb["obs_me_last_move"] = np.append(
-                    trial_rb["obs_me_last_move"], model_ins["obs_me_last_move"]
-                )
-                trial_rb["obs_them_last_move"] = np.append(
-                    trial_rb["obs_them_last_move"], model_ins["obs_them_last_move"]
-                )
-        for reward in event.rewards:
-            trial_rb["reward"][reward.tick_id] = reward.value
+                    # Observations from all the ongoing trials are evaluated together
+                    q_values = await _inference_batcher.q_values(me_last_move, them_last_move)
+                    action = np.argmax(q_values)
+                # Actions are indices in MOVES, not move values
+                actor_session.do_action(PlayerAction(move=MOVES[action]))
 
-    # Shifting the observations to get the next observations
-    trial_rb["next_obs_me_last_move"] = trial_rb["obs_me_last_move"][1:]
-    trial_rb["next_obs_them_last_move"] = trial_rb["obs_them_last_move"][1:]
-    # Dropping the last row, as it only contains the last observations
-    trial_rb["obs_me_last_move"] = trial_rb["obs_me_last_move"][:-1]
-    trial_rb["obs_them_last_move"] = trial_rb["obs_them_last_move"][:-1]
+                trial_recorder.add_action(action)
+        for reward in event.rewards:
+            trial_recorder.set_reward(reward.tick_id, reward.value)
 
-    append_trial_replay_buffer(trial_rb)
-    train()
+    # The recorder takes care of shifting the observations to get the next observations
+    # Learning happens in the background, the event loop is free to serve the other trials
+    _learner.push_trial(trial_recorder.transitions())
 
 
 async def main():
     print(f"Deep Q Learning agent service starting on port {PORT}...")
 
+    _learner.start()
+
     context = cogment.Context(cog_settings=cog_settings, user_id="rps")
     context.register_actor(
         impl=dqn_agent,
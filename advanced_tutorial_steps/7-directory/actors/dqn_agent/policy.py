@@ -0,0 +1,112 @@
+# Copyright 2023 AI Redefined Inc. <dev+cogment@ai-r.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+import numpy as np
+
+
+# Copy the weights of a model to another one having the same architecture
+# Variables are assigned to one another, the weights never go through numpy arrays
+def copy_weights(dst_model, src_model):
+    for (dst_variable, src_variable) in zip(dst_model.variables, src_model.variables):
+        dst_variable.assign(src_variable)
+
+
+class _DoubleBuffer:
+    """Front/back buffers swapped on publication, the back one is never written while still being read
+
+    Reads are expected to be done from a single thread, e.g. the asyncio event loop, while publications can be done
+    from any other thread.
+    """
+
+    def __init__(self):
+        self._front = 0
+        self._reading = None
+        self._publish_lock = threading.Lock()
+        self.version = 0
+
+    def _read_front(self, read):
+        # Mark the front buffer as being read, checking it didn't get swapped in the meantime
+        while True:
+            front = self._front
+            self._reading = front
+            if front == self._front:
+                break
+        try:
+            return read(front)
+        finally:
+            self._reading = None
+
+    def _publish_back(self, write):
+        with self._publish_lock:
+            back = 1 - self._front
+            # The back buffer might still be read by a reader started before the previous swap
+            while self._reading == back:
+                time.sleep(0)
+            write(back)
+            self._front = back
+            self.version += 1
+
+
+class DoubleBufferedPolicy(_DoubleBuffer):
+    """Versioned acting policy, updated without ever blocking the action selection
+
+    The observation space being tiny, the Q values of every possible state are computed once per published model
+    and stored in a lookup table, selecting an action is then a matter of indexing it. Two tables are kept, the front
+    one is read while the next one is written to the back one, the two are then swapped.
+    """
+
+    def __init__(self, states, model_ins_from_states, actions_count):
+        super().__init__()
+        # `states` lists every possible state as a (my last move, their last move) pair, the table is indexed by them
+        self._states = states
+        self._model_ins = model_ins_from_states(states)
+        self._state_indices = np.zeros((states[:, 0].max() + 1, states[:, 1].max() + 1), dtype=np.int32)
+        self._state_indices[states[:, 0], states[:, 1]] = np.arange(len(states))
+        self._q_tables = [np.zeros((len(states), actions_count), dtype=np.float32) for _ in range(2)]
+
+    def q_values(self, me_last_move, them_last_move):
+        return self._read_front(
+            lambda front: self._q_tables[front][self._state_indices[me_last_move, them_last_move]].copy()
+        )
+
+    def publish(self, src_model):
+        # Evaluate every state in one forward pass, before any waiting
+        q_table = src_model(self._model_ins, training=False).numpy()
+
+        def write(back):
+            self._q_tables[back][:] = q_table
+
+        self._publish_back(write)
+
+
+class DoubleBufferedModel(_DoubleBuffer):
+    """Versioned acting model, updated without ever blocking the inference
+
+    Used when the Q values aren't precomputed in a lookup table. Two copies of the model are kept, the front one is
+    used for inference while new weights are written to the back one, the two are then swapped.
+    """
+
+    def __init__(self, create_model):
+        super().__init__()
+        self._models = [create_model(), create_model()]
+        copy_weights(self._models[1], self._models[0])
+
+    def predict(self, model_ins):
+        return self._read_front(lambda front: self._models[front](model_ins, training=False))
+
+    def publish(self, src_model):
+        self._publish_back(lambda back: copy_weights(self._models[back], src_model))
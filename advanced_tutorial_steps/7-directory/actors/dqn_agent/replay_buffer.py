@@ -0,0 +1,130 @@
+# Copyright 2023 AI Redefined Inc. <dev+cogment@ai-r.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+# Fields stored for each transition, with their storage type
+# Moves fit in a byte, rewards are kept in single precision
+TRANSITION_FIELDS = {
+    "obs_me_last_move": np.int8,
+    "obs_them_last_move": np.int8,
+    "action": np.int8,
+    "reward": np.float32,
+    "next_obs_me_last_move": np.int8,
+    "next_obs_them_last_move": np.int8,
+}
+
+
+class ReplayBuffer:
+    """Fixed capacity circular replay buffer
+
+    All the storage is allocated upfront, once the buffer is full the oldest transitions get overwritten.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._data = {key: np.zeros(capacity, dtype=dtype) for (key, dtype) in TRANSITION_FIELDS.items()}
+        self._ptr = 0
+        self.num_total = 0
+
+    def size(self):
+        return min(self.num_total, self.capacity)
+
+    def add_transitions(self, transitions):
+        """Add a batch of transitions, given as a dict of equally sized arrays, to the buffer"""
+        count = len(transitions["obs_me_last_move"])
+        if count > self.capacity:
+            # Only the most recent transitions would survive anyway
+            transitions = {key: values[-self.capacity :] for (key, values) in transitions.items()}
+            self._ptr = (self._ptr + count - self.capacity) % self.capacity
+            self.num_total += count - self.capacity
+            count = self.capacity
+
+        # At most two slice copies per field, the second one handling the wrap around
+        first_count = min(count, self.capacity - self._ptr)
+        for key, storage in self._data.items():
+            values = transitions[key]
+            assert len(values) == count
+            storage[self._ptr : self._ptr + first_count] = values[:first_count]
+            storage[: count - first_count] = values[first_count:]
+
+        self._ptr = (self._ptr + count) % self.capacity
+        self.num_total += count
+
+    def sample(self, batch_size):
+        """Randomly select, with replacement, a batch of transitions"""
+        indices = np.random.randint(0, self.size(), size=batch_size)
+        return {key: storage[indices] for (key, storage) in self._data.items()}
+
+    def latest(self, key, count):
+        """Retrieve the values of a field for the `count` most recently added transitions"""
+        count = min(count, self.size())
+        indices = np.arange(self._ptr - count, self._ptr)
+        return np.take(self._data[key], indices, mode="wrap")
+
+
+class TrialRecorder:
+    """Accumulate the transitions of a single trial
+
+    Storage is preallocated and doubled whenever it's full, recording a tick has a constant amortized cost.
+    """
+
+    def __init__(self, initial_capacity=64):
+        self._obs_me_last_move = np.zeros(initial_capacity, dtype=np.int8)
+        self._obs_them_last_move = np.zeros(initial_capacity, dtype=np.int8)
+        self._action = np.zeros(initial_capacity, dtype=np.int8)
+        self._reward = np.zeros(initial_capacity, dtype=np.float32)
+        self.observations_count = 0
+        self.actions_count = 0
+
+    @staticmethod
+    def _grow(storage, required_size):
+        if required_size <= len(storage):
+            return storage
+        grown_storage = np.zeros(max(required_size, 2 * len(storage)), dtype=storage.dtype)
+        grown_storage[: len(storage)] = storage
+        return grown_storage
+
+    def add_observation(self, me_last_move, them_last_move):
+        self._obs_me_last_move = self._grow(self._obs_me_last_move, self.observations_count + 1)
+        self._obs_them_last_move = self._grow(self._obs_them_last_move, self.observations_count + 1)
+        self._obs_me_last_move[self.observations_count] = me_last_move
+        self._obs_them_last_move[self.observations_count] = them_last_move
+        self.observations_count += 1
+
+    def add_action(self, action):
+        self._action = self._grow(self._action, self.actions_count + 1)
+        self._reward = self._grow(self._reward, self.actions_count + 1)
+        self._action[self.actions_count] = action
+        self._reward[self.actions_count] = 0.0
+        self.actions_count += 1
+
+    def set_reward(self, tick_id, value):
+        self._reward[tick_id] = value
+
+    def transitions(self):
+        """Retrieve views on the recorded transitions
+
+        The next observation of a transition is the observation of the following tick,
+        the last observation of the trial is therefore only used as a next observation.
+        """
+        count = max(self.observations_count - 1, 0)
+        return {
+            "obs_me_last_move": self._obs_me_last_move[:count],
+            "obs_them_last_move": self._obs_them_last_move[:count],
+            "action": self._action[:count],
+            "reward": self._reward[:count],
+            "next_obs_me_last_move": self._obs_me_last_move[1 : count + 1],
+            "next_obs_them_last_move": self._obs_them_last_move[1 : count + 1],
+        }
@@ -0,0 +1,122 @@
+# Copyright 2023 AI Redefined Inc. <dev+cogment@ai-r.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from data_pb2 import ROCK, PAPER, SCISSORS
+
+import numpy as np
+
+MOVES = [ROCK, PAPER, SCISSORS]
+
+DEFEATS = {
+    ROCK: PAPER,
+    SCISSORS: ROCK,
+    PAPER: SCISSORS
+}
+
+NO_LAST_MOVE = -1  # Used in `last_moves` before the first round
+
+# DEFEATS as an array indexed by move, only the entries of `MOVES` are ever read
+_DEFEATS_ARRAY = np.full(max(DEFEATS.keys()) + 1, NO_LAST_MOVE, dtype=np.int8)
+for (move, defeating_move) in DEFEATS.items():
+    _DEFEATS_ARRAY[move] = defeating_move
+
+
+class BatchEngine:
+    """Play many games of RPS in lockstep
+
+    Every state is stored as an array indexed by game, the last axis of the per player arrays is the player index.
+    Games that are done are left untouched by subsequent steps.
+    """
+
+    def __init__(self, games_count, target_score=3):
+        self.games_count = games_count
+        self.target_score = target_score
+        self.reset()
+
+    def reset(self):
+        self.rounds_count = np.zeros(self.games_count, dtype=np.int32)
+        self.scores = np.zeros((self.games_count, 2), dtype=np.int32)
+        self.last_moves = np.full((self.games_count, 2), NO_LAST_MOVE, dtype=np.int8)
+        self.won_last = np.zeros((self.games_count, 2), dtype=bool)
+        self.done = np.zeros(self.games_count, dtype=bool)
+
+    def step(self, p1_moves, p2_moves):
+        """Play one round of every ongoing game
+
+        Returns the rewards of each player, non-zero only for the games that ended during this round,
+        and the mask of those games. Raises a `ValueError` if any move is not one of `MOVES`.
+        """
+        moves = np.stack([p1_moves, p2_moves], axis=1)
+        invalid_moves = ~np.isin(moves, MOVES)
+        if invalid_moves.any():
+            raise ValueError(f"Invalid moves {np.unique(moves[invalid_moves]).tolist()}, expected one of {MOVES}")
+        moves = moves.astype(np.int8)
+        ongoing = ~self.done
+
+        # Compute who wins, if the two players had the same move, nobody wins
+        won = np.stack(
+            [
+                moves[:, 0] == _DEFEATS_ARRAY[moves[:, 1]],
+                moves[:, 1] == _DEFEATS_ARRAY[moves[:, 0]],
+            ],
+            axis=1,
+        )
+
+        self.last_moves[ongoing] = moves[ongoing]
+        self.won_last[ongoing] = won[ongoing]
+        self.scores[ongoing] += won[ongoing]
+        self.rounds_count[ongoing] += 1
+
+        # Handle end of game
+        p1_reached_target = ongoing & (self.scores[:, 0] >= self.target_score)
+        p2_reached_target = ongoing & ~p1_reached_target & (self.scores[:, 1] >= self.target_score)
+        rewards = np.zeros((self.games_count, 2), dtype=np.float32)
+        rewards[p1_reached_target] = [1, -1]
+        rewards[p2_reached_target] = [-1, 1]
+
+        ended = p1_reached_target | p2_reached_target
+        self.done |= ended
+
+        return (rewards, ended)
+
+    def observations(self, player_idx):
+        """Observations of every game from the point of view of the given player
+
+        Returns the `me` and `them` last moves and won last flags as arrays.
+        """
+        other_player_idx = 1 - player_idx
+        return {
+            "me_last_move": self.last_moves[:, player_idx],
+            "me_won_last": self.won_last[:, player_idx],
+            "them_last_move": self.last_moves[:, other_player_idx],
+            "them_won_last": self.won_last[:, other_player_idx],
+        }
+
+    def play(self, p1_policy, p2_policy, max_rounds=1000):
+        """Play every game until its end, or until `max_rounds` rounds are played
+
+        Policies are functions taking the observations of a player and returning the moves for every game.
+        Returns the final rewards of each player.
+        """
+        final_rewards = np.zeros((self.games_count, 2), dtype=np.float32)
+        for _ in range(max_rounds):
+            if self.done.all():
+                break
+            (rewards, _) = self.step(p1_policy(self.observations(0)), p2_policy(self.observations(1)))
+            final_rewards += rewards
+        return final_rewards
+
+
+def random_policy(observations):
+    return np.random.choice(MOVES, size=len(observations["me_last_move"]))
@@ -13,7 +13,8 @@
 # limitations under the License.
 
 import cog_settings
-from data_pb2 import Observation, PlayerState, ROCK, PAPER, SCISSORS
+from data_pb2 import Observation, PlayerState
+from batch_engine import BatchEngine, NO_LAST_MOVE
 
 import cogment
 
@@ -24,68 +25,53 @@ PORT = int(os.getenv('ENVIRONMENT_PORT'))
 
 MOVES_STR = ["👊 rock", "✋ paper", "✌️ scissors"]
 
-DEFEATS = {
-    ROCK: PAPER,
-    SCISSORS: ROCK,
-    PAPER: SCISSORS
-}
+# Build the state of a player, "me" or "them", from the observations of a single game engine
+def player_state_from_engine_observations(observations, player):
+    last_move = observations[f"{player}_last_move"][0]
+    return PlayerState(
+        won_last=bool(observations[f"{player}_won_last"][0]),
+        last_move=int(last_move) if last_move != NO_LAST_MOVE else None,
+    )
+
+
+# Build the observation of a player from a single game engine
+def observation_from_engine(engine, player_idx):
+    observations = engine.observations(player_idx)
+    return Observation(
+        me=player_state_from_engine_observations(observations, "me"),
+        them=player_state_from_engine_observations(observations, "them"),
+    )
+
 
 async def environment(environment_session):
     # Default target score
     target_score = 3
     if environment_session.config is not None and environment_session.config.target_score >= 0:
         target_score = environment_session.config.target_score
-    state = {
-        "rounds_count": 0,
-        "p1": {
-            "score": 0
-        },
-        "p2": {
-            "score": 0
-        },
-    }
+    # The game is played by an engine running a single game
+    engine = BatchEngine(games_count=1, target_score=target_score)
     [p1, p2] = environment_session.get_active_actors()
-    p1_state = PlayerState(won_last=False, last_move=None)
-    p2_state = PlayerState(won_last=False, last_move=None)
     environment_session.start([
-        (p1.actor_name, Observation(me=p1_state, them=p2_state)),
-        (p2.actor_name, Observation(me=p2_state, them=p1_state)),
+        (p1.actor_name, observation_from_engine(engine, 0)),
+        (p2.actor_name, observation_from_engine(engine, 1)),
     ])
 
     async for event in environment_session.all_events():
         if event.actions:
             [p1_action, p2_action] = [recv_action.action for recv_action in event.actions]
 
-            # Compute who wins, if the two players had the same move, nobody wins
-            p1_state = PlayerState(
-                won_last=p1_action.move == DEFEATS[p2_action.move],
-                last_move=p1_action.move
-            )
-            p2_state = PlayerState(
-                won_last=p2_action.move == DEFEATS[p1_action.move],
-                last_move=p2_action.move
-            )
-            state["rounds_count"] += 1
-            if p1_state.won_last:
-                state["p1"]["score"] += 1
-            elif p2_state.won_last:
-                state["p2"]["score"] += 1
+            (rewards, ended) = engine.step([p1_action.move], [p2_action.move])
 
             # Generate and send observations
             observations = [
-                (p1.actor_name, Observation(me=p1_state, them=p2_state)),
-                (p2.actor_name, Observation(me=p2_state, them=p1_state)),
+                (p1.actor_name, observation_from_engine(engine, 0)),
+                (p2.actor_name, observation_from_engine(engine, 1)),
             ]
 
             # Handle end of game
-            if state["p1"]["score"] >= target_score:
-                environment_session.add_reward(value=1, confidence=1, to=[p1.actor_name])
-                environment_session.add_reward(value=-1, confidence=1, to=[p2.actor_name])
-
-                environment_session.end(observations)
-            elif state["p2"]["score"] >= target_score:
-                environment_session.add_reward(value=-1, confidence=1, to=[p1.actor_name])
-                environment_session.add_reward(value=1, confidence=1, to=[p2.actor_name])
+            if ended[0]:
+                environment_session.add_reward(value=float(rewards[0, 0]), confidence=1, to=[p1.actor_name])
+                environment_session.add_reward(value=float(rewards[0, 1]), confidence=1, to=[p2.actor_name])
 
                 environment_session.end(observations)
             else:
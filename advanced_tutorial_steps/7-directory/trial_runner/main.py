@@ -20,6 +20,142 @@ import cogment
 import asyncio
 import datetime
 import os
+import time
+from collections import OrderedDict
+
+TRIALS_COUNT = 1000
+PARALLEL_TRIALS_COUNT = int(os.getenv('PARALLEL_TRIALS_COUNT', '10'))
+
+
+# Value below which the given ratio of the sorted values fall
+def percentile(sorted_values, ratio):
+    return sorted_values[min(int(ratio * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def print_campaign_report(trials_durations, campaign_duration):
+    sorted_durations = sorted(trials_durations)
+    print(
+        f"{len(sorted_durations)} trials ran in {campaign_duration:.2f}s "
+        f"({len(sorted_durations) / campaign_duration:.2f} trials/sec), "
+        f"trial duration p50={percentile(sorted_durations, 0.5):.3f}s "
+        f"p95={percentile(sorted_durations, 0.95):.3f}s "
+        f"p99={percentile(sorted_durations, 0.99):.3f}s "
+        f"max={sorted_durations[-1]:.3f}s"
+    )
+
+
+class TrialEndDispatcher:
+    """Track the end of any number of trials using a single `watch_trials` subscription
+
+    The subscription is reopened whenever it fails or closes, the state of the started trials is then checked, until
+    it succeeds, to catch the trials that ended in the meantime.
+    """
+
+    def __init__(self, controller, reconnection_delay=1.0, max_unclaimed_trials=1000):
+        self._controller = controller
+        self._reconnection_delay = reconnection_delay
+        self._max_unclaimed_trials = max_unclaimed_trials
+        self._trial_ended_futures = {}
+        self._started_trial_ids = set()
+        # Ended trials without a future yet, e.g. trials that ended before being confirmed under another id
+        self._unclaimed_ended_trials = OrderedDict()
+        self._resync_pending = False
+        self._watch_task = None
+
+    def start(self):
+        self._watch_task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        self._watch_task.cancel()
+        try:
+            await self._watch_task
+        except asyncio.CancelledError:
+            pass
+
+    def expect_trial(self, trial_id):
+        """Create the future resolved with the trial info once the trial ends
+
+        Should be called before the trial is started to make sure its end is not missed.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._trial_ended_futures[trial_id] = future
+        return future
+
+    def trial_started(self, trial_id, started_trial_id):
+        """Confirm the start of an expected trial, under the id given by the orchestrator"""
+        if started_trial_id is None:
+            self.forget_trial(trial_id)
+            raise RuntimeError(f"Trial '{trial_id}' could not be started")
+        if started_trial_id != trial_id:
+            future = self._trial_ended_futures.pop(trial_id, None)
+            if future is None or future.done():
+                # Already ended under the requested id
+                return
+            self._trial_ended_futures[started_trial_id] = future
+        if started_trial_id in self._unclaimed_ended_trials:
+            self._trial_ended(started_trial_id, self._unclaimed_ended_trials.pop(started_trial_id))
+        elif started_trial_id in self._trial_ended_futures:
+            self._started_trial_ids.add(started_trial_id)
+
+    def forget_trial(self, trial_id):
+        """Stop expecting a trial, e.g. because it failed to start"""
+        future = self._trial_ended_futures.pop(trial_id, None)
+        if future is not None:
+            future.cancel()
+        self._started_trial_ids.discard(trial_id)
+
+    def _trial_ended(self, trial_id, trial_info):
+        future = self._trial_ended_futures.pop(trial_id, None)
+        self._started_trial_ids.discard(trial_id)
+        if future is None:
+            self._unclaimed_ended_trials[trial_id] = trial_info
+            if len(self._unclaimed_ended_trials) > self._max_unclaimed_trials:
+                self._unclaimed_ended_trials.popitem(last=False)
+        elif not future.done():
+            future.set_result(trial_info)
+
+    async def _resync(self):
+        """Check the state of the started trials, retrying until it succeeds"""
+        while self._resync_pending:
+            trial_ids = list(self._started_trial_ids)
+            try:
+                if len(trial_ids) > 0:
+                    trial_infos = await self._controller.get_trial_info(trial_ids)
+                    trial_infos = {trial_info.trial_id: trial_info for trial_info in trial_infos}
+                    # Trials unknown to the orchestrator ended long enough ago to be forgotten
+                    for trial_id in trial_ids:
+                        trial_info = trial_infos.get(trial_id)
+                        if trial_id in self._started_trial_ids and (
+                            trial_info is None or trial_info.state == cogment.TrialState.ENDED
+                        ):
+                            self._trial_ended(trial_id, trial_info)
+                self._resync_pending = False
+            except Exception as error:
+                print(f"Trials state check failed ({error}), retrying...")
+                await asyncio.sleep(self._reconnection_delay)
+
+    async def _watch(self):
+        while True:
+            resync_task = None
+            try:
+                trials = self._controller.watch_trials(trial_state_filters=[cogment.TrialState.ENDED])
+                if self._resync_pending:
+                    # Runs while the subscription is being consumed, trials ending meanwhile are caught by either one
+                    resync_task = asyncio.create_task(self._resync())
+                async for trial_info in trials:
+                    self._trial_ended(trial_info.trial_id, trial_info)
+                print("Trials watch closed, reconnecting...")
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                print(f"Trials watch failed ({error}), reconnecting...")
+            finally:
+                if resync_task is not None:
+                    resync_task.cancel()
+            # Unfinished checks are restarted along with the next subscription
+            self._resync_pending = True
+            await asyncio.sleep(self._reconnection_delay)
+
 
 async def main():
     print("Client starting...")
@@ -61,24 +197,48 @@ async def main():
     )
 
     # Listening for ended trials
-    async def await_trial(trial_id):
-        async for trial_info in controller.watch_trials(trial_state_filters=[cogment.TrialState.ENDED]):
-            if trial_info.trial_id == trial_id:
-                break
+    trial_end_dispatcher = TrialEndDispatcher(controller)
+    trial_end_dispatcher.start()
 
-    # Start a trial campaign
-    for i in range(1000):
-        # Defining the trial id on the client side
-        trial_id=f"rps-training#{i}-{datetime.datetime.now().isoformat()}"
+    trials_durations = []
 
-        await_trial_task = asyncio.create_task(await_trial(trial_id))
+    async def run_trial(trial_id):
+        trial_start = time.perf_counter()
+        trial_ended = trial_end_dispatcher.expect_trial(trial_id)
 
         # Start a new trial using the trial params we just created
-        trial_id = await controller.start_trial(trial_id_requested=trial_id, trial_params=trial_params)
-        print(f"Trial '{trial_id}' ongoing")
+        try:
+            started_trial_id = await controller.start_trial(trial_id_requested=trial_id, trial_params=trial_params)
+        except Exception:
+            trial_end_dispatcher.forget_trial(trial_id)
+            raise
+        trial_end_dispatcher.trial_started(trial_id, started_trial_id)
+        print(f"Trial '{started_trial_id}' ongoing")
 
         # Wait for the trial to end
-        await await_trial_task
+        await trial_ended
+        trials_durations.append(time.perf_counter() - trial_start)
+        if len(trials_durations) % 100 == 0:
+            print_campaign_report(trials_durations, time.perf_counter() - campaign_start)
+
+    # Start a trial campaign, keeping up to PARALLEL_TRIALS_COUNT trials running at the same time
+    campaign_start = time.perf_counter()
+    running_trials = set()
+    for i in range(TRIALS_COUNT):
+        # Wait for a slot to be freed
+        if len(running_trials) >= PARALLEL_TRIALS_COUNT:
+            ended_trials, running_trials = await asyncio.wait(running_trials, return_when=asyncio.FIRST_COMPLETED)
+            for ended_trial in ended_trials:
+                # Propagate any error
+                ended_trial.result()
+
+        # Defining the trial id on the client side
+        trial_id=f"rps-training#{i}-{datetime.datetime.now().isoformat()}"
+        running_trials.add(asyncio.create_task(run_trial(trial_id)))
+
+    await asyncio.gather(*running_trials)
+    await trial_end_dispatcher.stop()
+    print_campaign_report(trials_durations, time.perf_counter() - campaign_start)
 
 if __name__ == '__main__':
     asyncio.run(main())
@@ -0,0 +1,95 @@
+# Copyright 2023 AI Redefined Inc. <dev+cogment@ai-r.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+import torch
+import fire
+
+from model import APPOModel
+
+
+def compute_gae_loop(rewards, values, dones, next_value, gamma=0.99, lambda_=0.95):
+    """Reference step by step implementation of the GAE"""
+    advs = []
+    with torch.no_grad():
+        gae = 0.0
+        for i in reversed(range(len(rewards))):
+            delta = rewards[i] + gamma * next_value * (1 - dones[i]) - values[i]
+            gae = delta + gamma * lambda_ * (1 - dones[i]) * gae
+            advs.append(gae)
+            next_value = values[i]
+    advs.reverse()
+
+    return torch.stack(advs)
+
+
+def random_rollout(num_steps):
+    rewards = torch.randint(-1, 2, (num_steps,), dtype=torch.float32)
+    values = torch.randn(num_steps)
+    dones = (torch.rand(num_steps) < 0.01).to(torch.float32)
+    next_value = torch.randn(1)
+    return rewards, values, dones, next_value
+
+
+def measure_duration(func, num_repeats):
+    start = time.perf_counter()
+    for _ in range(num_repeats):
+        func()
+    return (time.perf_counter() - start) / num_repeats
+
+
+def main(num_repeats=10):
+    """Check the vectorized GAE against the step by step reference and compare their durations"""
+    model = APPOModel()
+    gamma = model.cfg.discount_factor
+    lambda_ = model.cfg.lambda_gae
+
+    for num_steps in [128, 256, 512, 1024, 2048, 4096]:
+        rewards, values, dones, next_value = random_rollout(num_steps)
+
+        expected_advs = compute_gae_loop(rewards, values, dones, next_value, gamma, lambda_).flatten()
+        advs = model.compute_gae(rewards, values, dones, next_value, gamma, lambda_)
+        torch.testing.assert_close(advs, expected_advs, rtol=1e-4, atol=1e-4)
+
+        loop_duration = measure_duration(
+            lambda: compute_gae_loop(rewards, values, dones, next_value, gamma, lambda_), num_repeats
+        )
+        vectorized_duration = measure_duration(
+            lambda: model.compute_gae(rewards, values, dones, next_value, gamma, lambda_), num_repeats
+        )
+        print(
+            f"rollout length [{num_steps}] | loop [{loop_duration * 1000:.2f}ms] | "
+            f"vectorized [{vectorized_duration * 1000:.2f}ms] | speedup [x{loop_duration / vectorized_duration:.1f}]"
+        )
+
+    # Several rollouts at once
+    num_rollouts = 16
+    rollouts = [random_rollout(128) for _ in range(num_rollouts)]
+    batched_advs = model.compute_gae(
+        torch.stack([r[0] for r in rollouts], dim=1),
+        torch.stack([r[1] for r in rollouts], dim=1),
+        torch.stack([r[2] for r in rollouts], dim=1),
+        torch.stack([r[3] for r in rollouts], dim=1),
+        gamma,
+        lambda_,
+    )
+    for (rollout_idx, rollout) in enumerate(rollouts):
+        expected_advs = compute_gae_loop(*rollout, gamma, lambda_).flatten()
+        torch.testing.assert_close(batched_advs[:, rollout_idx], expected_advs, rtol=1e-4, atol=1e-4)
+    print(f"[{num_rollouts}] batched rollouts match the reference")
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
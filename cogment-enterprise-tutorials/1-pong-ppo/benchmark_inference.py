@@ -0,0 +1,89 @@
+# Copyright 2023 AI Redefined Inc. <dev+cogment@ai-r.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import time
+
+import torch
+import fire
+
+from environment import PONG_OBSERVATION_SHAPE
+from inference import InferenceBatcher
+from model import APPOModel
+
+
+def random_observation():
+    return torch.randint(0, 256, (1, *PONG_OBSERVATION_SHAPE[::-1]), dtype=torch.uint8)
+
+
+async def unbatched_session(model, num_steps):
+    """Reference session, computing its actions one at a time"""
+    observation = random_observation()
+    for _ in range(num_steps):
+        with torch.no_grad():
+            model.network.get_action(observation.to(model.device)).sample()
+        # Let the other sessions run, as when waiting for the next observation
+        await asyncio.sleep(0)
+
+
+async def batched_session(model, inference_batcher, num_steps):
+    observation = random_observation()
+    inference_batcher.add_session()
+    for _ in range(num_steps):
+        await inference_batcher.action(model, observation)
+        await asyncio.sleep(0)
+    inference_batcher.remove_session()
+
+
+async def measure_actions_per_sec(session_factory, num_sessions, num_steps):
+    start = time.perf_counter()
+    await asyncio.gather(*[session_factory() for _ in range(num_sessions)])
+    return num_sessions * num_steps / (time.perf_counter() - start)
+
+
+async def run(num_steps, max_batch_size, max_wait_us):
+    model = APPOModel()
+
+    # Batched policies match the per observation ones
+    observations = torch.cat([random_observation() for _ in range(max_batch_size)]).to(model.device)
+    with torch.no_grad():
+        batched_probs = model.network.get_action(observations).probs
+        for (obs_idx, observation) in enumerate(observations):
+            probs = model.network.get_action(observation.unsqueeze(0)).probs
+            torch.testing.assert_close(batched_probs[obs_idx : obs_idx + 1], probs, rtol=1e-4, atol=1e-5)
+
+    for num_sessions in [1, 4, 16, 64]:
+        unbatched_actions_per_sec = await measure_actions_per_sec(
+            lambda: unbatched_session(model, num_steps), num_sessions, num_steps
+        )
+        inference_batcher = InferenceBatcher(max_batch_size=max_batch_size, max_wait_us=max_wait_us)
+        batched_actions_per_sec = await measure_actions_per_sec(
+            lambda: batched_session(model, inference_batcher, num_steps), num_sessions, num_steps
+        )
+        assert inference_batcher.requests_count == num_sessions * num_steps
+        print(
+            f"sessions [{num_sessions}] | unbatched [{unbatched_actions_per_sec:.0f}] actions/s | "
+            f"batched [{batched_actions_per_sec:.0f}] actions/s "
+            f"(avg. batch size [{inference_batcher.requests_count / inference_batcher.batches_count:.1f}]) | "
+            f"speedup [x{batched_actions_per_sec / unbatched_actions_per_sec:.1f}]"
+        )
+
+
+def main(num_steps=100, max_batch_size=32, max_wait_us=1000):
+    """Check the batched policy against the per observation one and compare the actions/sec of concurrent sessions"""
+    asyncio.run(run(num_steps, max_batch_size, max_wait_us))
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -0,0 +1,99 @@
+# Copyright 2023 AI Redefined Inc. <dev+cogment@ai-r.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+import numpy as np
+import torch
+import fire
+
+from data_pb2 import Observation, HWC, CHW, RAW, ZLIB
+from environment import PONG_OBSERVATION_SHAPE, observation_to_message
+from observation_codec import decode_observation
+
+
+def decode_observation_copy(observation):
+    """Reference decoding, converting and copying the observation before reshaping it"""
+    obs = torch.tensor(np.frombuffer(observation.value, dtype=np.uint8), dtype=torch.float32)
+    return torch.unsqueeze(obs.reshape(tuple(PONG_OBSERVATION_SHAPE)).permute((2, 0, 1)), dim=0)
+
+
+def pong_like_frames(num_frames):
+    """Frame stacked, Pong looking, observations: a uniform background with moving paddles and ball"""
+    rng = np.random.default_rng(0)
+    (height, width, num_channels) = PONG_OBSERVATION_SHAPE
+    frames = np.full((num_frames, height, width, num_channels), 87, dtype=np.uint8)
+    frames[:, :, :, 4] = 1  # Agent indicators
+    frames[:, :, :, 5] = 0
+    for frame in frames:
+        (left_paddle_y, right_paddle_y, ball_y, ball_x) = rng.integers(10, height - 10, 4)
+        for stack_idx in range(4):
+            frame[left_paddle_y + stack_idx : left_paddle_y + stack_idx + 8, 8:10, stack_idx] = 147
+            frame[right_paddle_y - stack_idx : right_paddle_y - stack_idx + 8, 74:76, stack_idx] = 147
+            frame[ball_y + stack_idx : ball_y + stack_idx + 2, ball_x - stack_idx : ball_x - stack_idx + 1, stack_idx] = 236
+    return frames
+
+
+def measure_throughput(func, observations, num_repeats):
+    start = time.perf_counter()
+    for _ in range(num_repeats):
+        for (obs_idx, observation) in enumerate(observations):
+            func(obs_idx, observation)
+    duration = time.perf_counter() - start
+    num_observations = num_repeats * len(observations)
+    num_bytes = num_observations * np.prod(PONG_OBSERVATION_SHAPE)
+    return (num_observations / duration, num_bytes / duration / 1_000_000)
+
+
+def main(num_observations=1024, num_repeats=5):
+    """Check the observation codec against the reference decoding and compare their throughputs"""
+    frames = pong_like_frames(num_observations)
+    formats = [("HWC", HWC, RAW), ("CHW", CHW, RAW), ("CHW, zlib", CHW, ZLIB)]
+    formats_observations = [
+        [observation_to_message(frame, layout, encoding) for frame in frames] for (_, layout, encoding) in formats
+    ]
+    buffer = torch.zeros((num_observations, *PONG_OBSERVATION_SHAPE[::-1]), dtype=torch.uint8)
+
+    for (obs_idx, frame) in enumerate(frames):
+        expected_obs = decode_observation_copy(Observation(value=frame.tobytes()))
+        for observations in formats_observations:
+            observation = observations[obs_idx]
+            torch.testing.assert_close(decode_observation(observation).unsqueeze(0).to(torch.float32), expected_obs)
+            decode_observation(observation, out=buffer[obs_idx])
+            torch.testing.assert_close(buffer[obs_idx : obs_idx + 1].to(torch.float32), expected_obs)
+
+    for ((name, _, _), observations) in zip(formats, formats_observations):
+        wire_bytes = np.mean([len(observation.value) for observation in observations])
+        print(f"{name} | [{wire_bytes:.0f}] bytes per observation on the wire")
+
+    def to_buffer_copy(obs_idx, observation):
+        buffer[obs_idx] = decode_observation_copy(observation)
+
+    def to_buffer_codec(obs_idx, observation):
+        decode_observation(observation, out=buffer[obs_idx])
+
+    benchmarks = [
+        ("reference, to tensor", lambda _, observation: decode_observation_copy(observation), formats_observations[0]),
+        ("reference, to buffer slot", to_buffer_copy, formats_observations[0]),
+    ]
+    for ((name, _, _), observations) in zip(formats, formats_observations):
+        benchmarks.append((f"codec, {name}, view", lambda _, observation: decode_observation(observation), observations))
+        benchmarks.append((f"codec, {name}, to buffer slot", to_buffer_codec, observations))
+    for (name, func, observations) in benchmarks:
+        (observations_per_sec, mb_per_sec) = measure_throughput(func, observations, num_repeats)
+        print(f"{name} | [{observations_per_sec:.0f}] observations/s | [{mb_per_sec:.0f}] MB/s")
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -0,0 +1,111 @@
+# Copyright 2023 AI Redefined Inc. <dev+cogment@ai-r.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import io
+import os
+import tempfile
+import time
+
+import torch
+import fire
+
+import model as bench_model
+from model import APPOModel, PolicyValueNetwork
+
+
+def serialize_model_pickle(model):
+    """Reference serialization, pickling the whole network"""
+    stream = io.BytesIO()
+    torch.save(model.network, stream)
+    return stream.getvalue()
+
+
+def deserialize_model_pickle(serial_data):
+    network = torch.load(io.BytesIO(serial_data), map_location=torch.device("cpu"))
+    network.eval()
+    return APPOModel(network)
+
+
+def serialize_baseline_model_pickle(model):
+    """Pickled network as published before the observation scale became a buffer of the network"""
+    network = copy.deepcopy(model.network)
+    del network._buffers["observation_scale"]
+    stream = io.BytesIO()
+    torch.save(network, stream)
+    return stream.getvalue()
+
+
+def assert_baseline_observation_scaling(network):
+    observation = torch.randint(0, 256, (2, 6, 84, 84), dtype=torch.uint8)
+    observation[:, 4:] %= 2
+    # Previous in network normalization of the frames
+    expected_observation = observation.to(torch.float32)
+    expected_observation[:, [0, 1, 2, 3], :, :] /= 255.0
+    with torch.no_grad():
+        expected_value = network.value(network.shared_network(expected_observation))
+        torch.testing.assert_close(network.get_value(observation), expected_value)
+
+
+def measure_duration(func, num_repeats):
+    start = time.perf_counter()
+    for _ in range(num_repeats):
+        func()
+    return (time.perf_counter() - start) / num_repeats
+
+
+def assert_same_weights(network, expected_network):
+    expected_state_dict = expected_network.state_dict()
+    for (name, tensor) in network.state_dict().items():
+        torch.testing.assert_close(tensor.cpu(), expected_state_dict[name].cpu(), rtol=0, atol=0)
+
+
+def main(num_repeats=20):
+    """Check the weights format round trip, and the loading of pickled networks, and compare their durations and size"""
+    model = APPOModel()
+    pickle_data = serialize_model_pickle(model)
+    weights_data = bench_model.serialize_model(model)
+
+    preallocated_network = PolicyValueNetwork(num_actions=model.cfg.num_actions)
+    bench_model.load_weights(preallocated_network, weights_data)
+    assert_same_weights(preallocated_network, model.network)
+    assert_same_weights(bench_model.deserialize_eval_model(weights_data).network, model.network)
+    assert_same_weights(bench_model.deserialize_eval_model(pickle_data).network, model.network)
+    baseline_network = bench_model.deserialize_eval_model(serialize_baseline_model_pickle(model)).network
+    assert_same_weights(baseline_network, model.network)
+    assert_baseline_observation_scaling(baseline_network)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        weights_path = os.path.join(tmp_dir, "weights.bin")
+        bench_model.save_weights_file(model, weights_path)
+        mapped_network = PolicyValueNetwork(num_actions=model.cfg.num_actions)
+        bench_model.load_weights_file(mapped_network, weights_path)
+        assert_same_weights(mapped_network, model.network)
+
+        print(f"pickle | [{len(pickle_data)}] bytes")
+        print(f"weights format | [{len(weights_data)}] bytes")
+        for (name, func) in [
+            ("pickle, serialize", lambda: serialize_model_pickle(model)),
+            ("weights format, serialize", lambda: bench_model.serialize_model(model)),
+            ("pickle, deserialize", lambda: deserialize_model_pickle(pickle_data)),
+            ("weights format, deserialize", lambda: bench_model.deserialize_eval_model(weights_data)),
+            ("weights format, load in place", lambda: bench_model.load_weights(preallocated_network, weights_data)),
+            ("weights format, load in place, memory mapped", lambda: bench_model.load_weights_file(mapped_network, weights_path)),
+        ]:
+            duration = measure_duration(func, num_repeats)
+            print(f"{name} | [{duration * 1000:.2f}ms]")
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
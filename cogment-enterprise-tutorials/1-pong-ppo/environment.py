@@ -15,6 +15,7 @@
 import asyncio
 import logging
 import os
+import zlib
 
 import numpy as np
 import cogment
@@ -23,10 +24,11 @@ import supersuit as ss
 from pettingzoo.atari import pong_v3
 
 import cog_settings
-from data_pb2 import Observation
+from data_pb2 import Observation, HWC, CHW, RAW, ZLIB
 
 PONG_OBSERVATION_SHAPE = [84, 84, 6]  # Observation in pong is an image
 PONG_NB_PLAYERS = 2
+ZLIB_COMPRESSION_LEVEL = 1  # Favor speed, higher levels barely improve the ratio of Pong frames
 
 log = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -43,7 +45,20 @@ def atari_env_wrapper(env: gymna.Env) -> gymna.Env:
 
     return env
 
+def observation_to_message(observation: np.ndarray, layout=HWC, encoding=RAW) -> Observation:
+    """Serialize an HWC observation image in the requested wire layout and encoding"""
+    if layout == CHW:
+        # Transposed once here rather than by every consumer
+        value = observation.transpose((2, 0, 1)).tobytes()
+    else:
+        value = observation.tobytes()
+    if encoding == ZLIB:
+        value = zlib.compress(value, ZLIB_COMPRESSION_LEVEL)
+    return Observation(value=value, layout=layout, encoding=encoding)
+
 async def pong_environment(session):
+    observation_layout = session.config.observation_layout if session.config is not None else HWC
+    observation_encoding = session.config.observation_encoding if session.config is not None else RAW
 
     # Actor info
     actors = session.get_active_actors()
@@ -64,7 +79,7 @@ async def pong_environment(session):
     observation, _, _, _ = env.last()
 
     # logging.info(f"obs env: {observation}")
-    session.start([(player_names[0], Observation(value=observation.tobytes()))])
+    session.start([(player_names[0], observation_to_message(observation, observation_layout, observation_encoding))])
 
     async for event in session.all_events():
         if not event.actions:
@@ -78,11 +93,11 @@ async def pong_environment(session):
         session.add_reward(value=reward, confidence=1.0, to=player_names)
         if not done:
             session.produce_observations(
-                [(player_names[0], Observation(value=observation.tobytes()))]
+                [(player_names[0], observation_to_message(observation, observation_layout, observation_encoding))]
             )
         else:
             session.end(
-                [(player_names[0], Observation(value=observation.tobytes()))]
+                [(player_names[0], observation_to_message(observation, observation_layout, observation_encoding))]
             )
     env.close()
 
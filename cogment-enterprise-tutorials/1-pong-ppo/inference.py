@@ -0,0 +1,87 @@
+# Copyright 2023 AI Redefined Inc. <dev+cogment@ai-r.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+import torch
+
+
+class InferenceBatcher:
+    """Gather the action requests of all the concurrent actor sessions into batches
+
+    Requests are held until either `max_batch_size` of them are pending, every registered session is waiting for an
+    action or the oldest one waited `max_wait_us` microseconds. A single forward pass is then computed for the requests
+    using the same model, and the actions are sampled for the whole batch at once.
+    """
+
+    def __init__(self, max_batch_size=32, max_wait_us=1000):
+        self.max_batch_size = max_batch_size
+        self.max_wait_us = max_wait_us
+        self._pending = {}  # model -> list of (observation, future)
+        self._pending_count = 0
+        self._flush_handle = None
+        self.sessions_count = 0
+        self.batches_count = 0
+        self.requests_count = 0
+
+    def add_session(self):
+        self.sessions_count += 1
+
+    def remove_session(self):
+        self.sessions_count -= 1
+        # The remaining sessions might all be waiting
+        if self._pending_count > 0 and self._pending_count >= self.sessions_count:
+            self._flush()
+
+    async def action(self, model, observation: torch.Tensor) -> int:
+        """Sample an action of the given model for a batch of one observation"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # The observation is only read when flushing, callers wait for the result before overwriting it
+        model_pending = self._pending.setdefault(model, [])
+        model_pending.append((observation, future))
+        self._pending_count += 1
+
+        if len(model_pending) >= self.max_batch_size or self._pending_count >= self.sessions_count:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait_us / 1_000_000, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        pending = self._pending
+        self._pending = {}
+        self._pending_count = 0
+        for (model, model_pending) in pending.items():
+            try:
+                observations = torch.cat([observation for (observation, _) in model_pending]).to(model.device)
+                with torch.no_grad():
+                    actions = model.network.get_action(observations).sample().tolist()
+            except Exception as error:
+                for (_, future) in model_pending:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+
+            self.batches_count += 1
+            self.requests_count += len(model_pending)
+            for ((_, future), action) in zip(model_pending, actions):
+                # The requesting session might have been cancelled in the meantime
+                if not future.done():
+                    future.set_result(action)
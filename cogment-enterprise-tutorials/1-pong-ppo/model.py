@@ -13,6 +13,10 @@
 # limitations under the License.
 
 import io
+import json
+import mmap
+import struct
+import warnings
 from typing import Tuple, Union
 from dataclasses import dataclass
 
@@ -23,16 +27,24 @@ from torch.distributions.categorical import Categorical
 
 def initialize_layer(layer: torch.nn.Module, std: float = np.sqrt(2), bias_const: float = 0.0):
     """Layer initialization"""
+    if layer.weight.is_meta:
+        # Layers allocated on the meta device get their weights loaded afterward
+        return layer
     torch.nn.init.orthogonal_(layer.weight, std)
     torch.nn.init.constant_(layer.bias, bias_const)
     return layer
 
+def default_observation_scale() -> torch.Tensor:
+    """Frames (channels 0 to 3) are scaled to [0, 1], agent indicators (channels 4 & 5) are left untouched"""
+    return torch.tensor([1 / 255.0] * 4 + [1.0] * 2, dtype=torch.float32).view(1, 6, 1, 1)
+
 class PolicyValueNetwork(torch.nn.Module):
     """Policy and Value networks for Atari games"""
 
     def __init__(self, num_actions: int) -> None:
         super().__init__()
         self.num_actions = num_actions
+        self.register_buffer("observation_scale", default_observation_scale())
         self.shared_network = torch.nn.Sequential(
             initialize_layer(torch.nn.Conv2d(6, 32, 8, stride=4)),
             torch.nn.ReLU(),
@@ -47,35 +59,39 @@ class PolicyValueNetwork(torch.nn.Module):
         self.actor = initialize_layer(torch.nn.Linear(512, num_actions), std=0.01)
         self.value = initialize_layer(torch.nn.Linear(512, 1), std=1)
 
+    def __setstate__(self, state) -> None:
+        super().__setstate__(state)
+        # Networks pickled before the introduction of the buffer scaled the observations the same way
+        if "observation_scale" not in self._buffers:
+            device = next(self.parameters()).device
+            self.register_buffer("observation_scale", default_observation_scale().to(device))
+
+    def get_hidden(self, observation: torch.Tensor) -> torch.Tensor:
+        """Compute the shared representation of uint8 or float observations"""
+        return self.shared_network(observation.to(self.observation_scale.dtype) * self.observation_scale)
+
     def get_value(self, observation: torch.Tensor) -> torch.Tensor:
         """Compute the value of being in a state"""
-        observation_clone = observation.clone()
-        observation_clone[:, [0, 1, 2, 3], :, :] /= 255.0
-        return self.value(self.shared_network(observation_clone))
+        return self.value(self.get_hidden(observation))
 
     def get_action(self, observation: torch.Tensor) -> Distribution:
         """Actions given observations"""
-        observation_clone = observation.clone()
-
-        observation_clone[:, [0, 1, 2, 3], :, :] /= 255.0
-        action_logits = self.actor(self.shared_network(observation_clone))
+        action_logits = self.actor(self.get_hidden(observation))
         dist = Categorical(logits=action_logits)
 
         return dist
 
+    def get_action_and_value(self, observation: torch.Tensor) -> Tuple[Distribution, torch.Tensor]:
+        """Actions distribution and value given observations, computed with a single forward pass"""
+        hidden = self.get_hidden(observation)
+        dist = Categorical(logits=self.actor(hidden))
+        return dist, self.value(hidden)
+
     def get_action_value(self, observation: torch.Tensor, action: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
         """Get value and log prob"""
-        observation_clone = observation.clone()
-        observation_clone[:, [0, 1, 2, 3], :, :] /= 255.0
-        hidden = self.shared_network(observation_clone)
-
-        # Log probs
-        action_logits = self.actor(hidden)
-        dist = Categorical(logits=action_logits)
+        dist, values = self.get_action_and_value(observation)
         log_probs = dist.log_prob(action)
 
-        # Value
-        values = self.value(hidden)
         return values, log_probs, dist.entropy()
 
 
@@ -98,10 +114,14 @@ class Config:
     clipping_coef: float = 0.1
     grad_norm: float = 0.5
     num_actions: int = 6
+    deferred_rollout_evaluation: bool = True  # Evaluate values & log probs in batches once the rollout is complete
+    rollout_evaluation_batch_size: int = 64
+    deduplicate_observation_planes: bool = True  # Store the frames shared by stacked observations once
+    observation_planes_per_sample: float = 1.5  # Size of the plane storage of the data buffer, relative to `buffer_size`
 
 
 class APPOModel:
-    def __init__(self, network: Union[torch.nn.Module, None] = None) -> None:
+    def __init__(self, network: Union[torch.nn.Module, None] = None, with_optimizer: bool = True) -> None:
         self.cfg = Config()
         if self.cfg.device == "cuda" and torch.cuda.is_available():
             self.device = torch.device("cuda")
@@ -113,7 +133,9 @@ class APPOModel:
         else:
             self.network = network
         self.network.to(self.device)
-        self.network_optimizer = torch.optim.Adam(self.network.parameters(), lr=self.cfg.learning_rate, eps=1e-5)
+        self.network_optimizer = None
+        if with_optimizer:
+            self.network_optimizer = torch.optim.Adam(self.network.parameters(), lr=self.cfg.learning_rate, eps=1e-5)
 
     def update_parameters(
         self,
@@ -130,7 +152,6 @@ class APPOModel:
         returns = advs + values
         num_obs = len(returns)
         global_idx = np.arange(num_obs)
-        self.network.to(self.device)
         for i in range(num_epochs):
             np.random.seed(self.cfg.seed + i + num_updates)
             np.random.shuffle(global_idx)
@@ -195,22 +216,55 @@ class APPOModel:
         next_value: torch.Tensor,
         gamma: float = 0.99,
         lambda_: float = 0.95,
-    ):
+        chunk_size: int = 256,
+    ) -> torch.Tensor:
         """Compute Generalized Advantage Estimation (GAE). See equations 11 & 12 in
         https://arxiv.org/pdf/1707.06347.pdf
+
+        Rollouts are laid out along the first dimension, several rollouts can be processed at once by stacking them
+        along a second dimension. Dones are expected to be either 0 or 1.
+
+        The reverse discounted scan is computed over chunks of `chunk_size` steps, within a chunk the advantages are
+        the product of the matrix of cumulated discounts by the TD errors.
         """
-        advs = []
         with torch.no_grad():
-            gae = 0.0
-            # dones = torch.cat((dones, torch.zeros(1, 1).to(self._torch_device)), dim=0)
-            for i in reversed(range(len(rewards))):
-                delta = rewards[i] + gamma * next_value * (1 - dones[i]) - values[i]
-                gae = delta + gamma * lambda_ * (1 - dones[i]) * gae
-                advs.append(gae)
-                next_value = values[i]
-        advs.reverse()
+            rewards_shape = rewards.shape
+            num_steps = rewards.size(dim=0)
+            rewards = rewards.reshape(num_steps, -1)
+            values = values.reshape(num_steps, -1)
+            dones = dones.reshape(num_steps, -1).to(rewards.dtype)
+            next_value = next_value.reshape(1, -1).to(rewards.dtype)
+
+            not_dones = 1.0 - dones
+            next_values = torch.cat((values[1:], next_value), dim=0)
+            deltas = rewards + gamma * next_values * not_dones - values
+
+            advs = torch.empty_like(deltas)
+            gae = torch.zeros_like(next_value[0])
+            for end in range(num_steps, 0, -chunk_size):
+                start = max(0, end - chunk_size)
+                chunk_len = end - start
+
+                # discount[t, k] = (gamma * lambda)^(k - t) if there is no done in [t, k - 1] else 0, for k >= t
+                # the last column (k = chunk_len) discounts the advantage carried from the next chunk
+                dones_count = torch.cat(
+                    (torch.zeros_like(dones[:1]), torch.cumsum(dones[start:end], dim=0)), dim=0
+                )
+                steps = torch.arange(chunk_len + 1, dtype=rewards.dtype, device=rewards.device)
+                distances = steps.unsqueeze(0) - steps[:-1].unsqueeze(1)
+                no_done = (dones_count.unsqueeze(0) - dones_count[:-1].unsqueeze(1)) == 0
+                discount = torch.where(
+                    (distances >= 0).unsqueeze(-1) & no_done,
+                    ((gamma * lambda_) ** distances.clamp(min=0)).unsqueeze(-1),
+                    torch.zeros((), dtype=rewards.dtype, device=rewards.device),
+                )
 
-        return advs
+                advs[start:end] = (
+                    torch.einsum("tkb,kb->tb", discount[:, :-1], deltas[start:end]) + discount[:, -1] * gae
+                )
+                gae = advs[start]
+
+        return advs.reshape(rewards_shape)
 
 class APPODataBufferSample:
     """APPO replay buffer's sample"""
@@ -234,9 +288,13 @@ class APPODataBufferSample:
         return self.observation.size(dim=0)
 
 class APPODataBuffer:
-    """Replay buffer for PPO"""
+    """Replay buffer for PPO, observations are kept in their native uint8 form and normalized by the network
 
-    observations: torch.Tensor
+    Given a `plane_capacity`, the distinct observation planes (e.g. stacked frames) of each rollout are stored once in a
+    circular plane storage, samples referencing overwritten planes are evicted.
+    """
+
+    observations: Union[torch.Tensor, None]  # None when observations are stored by plane
     actions: torch.Tensor
     advs: torch.Tensor
     values: torch.Tensor
@@ -250,22 +308,46 @@ class APPODataBuffer:
         device: torch.device = torch.device("cpu"),
         seed: int = 0,
         dtype: torch.dtype = torch.float32,
+        observation_dtype: torch.dtype = torch.uint8,
+        plane_capacity: Union[int, None] = None,
     ):
         self.capacity = capacity
         self.observation_shape = observation_shape
         self.action_shape = action_shape
         self.dtype = dtype
+        self.observation_dtype = observation_dtype
         self.device = device
         self.seed = seed
+        self.plane_capacity = plane_capacity
 
         # Initialize data storage
-        self.observations = torch.zeros((self.capacity, *self.observation_shape), dtype=self.dtype)
+        if self.plane_capacity is None:
+            self.observations = torch.zeros((self.capacity, *self.observation_shape), dtype=self.observation_dtype)
+        else:
+            # Observations are only available through `sample`
+            self.observations = None
+            (num_planes, *plane_shape) = self.observation_shape
+            self.planes = torch.zeros((self.plane_capacity, *plane_shape), dtype=self.observation_dtype)
+            self.plane_indices = torch.zeros((self.capacity, num_planes), dtype=torch.int64)
+            # Planes are numbered in insertion order, samples keep the number of the oldest plane they reference
+            self.oldest_plane_serials = torch.zeros((self.capacity,), dtype=torch.int64)
+            self._plane_ptr = 0
+            self.num_planes_total = 0
+            # Odd 64 bits weights of the plane hash, every byte of the plane affects the hash
+            generator = torch.Generator().manual_seed(self.seed)
+            plane_num_bytes = int(np.prod(plane_shape)) * torch.tensor([], dtype=self.observation_dtype).element_size()
+            self._plane_hash_weights = None
+            if plane_num_bytes % 8 == 0:
+                self._plane_hash_weights = (
+                    torch.randint(-(2**62), 2**62, (plane_num_bytes // 8,), dtype=torch.int64, generator=generator) | 1
+                )
         self.actions = torch.zeros((self.capacity, *self.action_shape), dtype=self.dtype)
         self.advs = torch.zeros((self.capacity, 1), dtype=self.dtype)
         self.values = torch.zeros((self.capacity, 1), dtype=self.dtype)
         self.log_probs = torch.zeros((self.capacity, 1), dtype=self.dtype)
         self._ptr = 0
         self.num_total = 0
+        self._first_sample_serial = 0  # Samples are numbered in insertion order, the older ones have been evicted
         self.count = 0
 
     def add(
@@ -276,50 +358,146 @@ class APPODataBuffer:
         value: torch.Tensor,
         log_prob: torch.Tensor,
     ) -> None:
-        self.observations[self._ptr] = observation
+        if self.plane_capacity is None:
+            self.observations[self._ptr] = observation
+        else:
+            self._add_planes(observation.reshape(1, *self.observation_shape))
         self.actions[self._ptr] = action
         self.advs[self._ptr] = adv
         self.values[self._ptr] = value
         self.log_probs[self._ptr] = log_prob
         self._ptr = (self._ptr + 1) % self.capacity
         self.num_total += 1
+        if self.plane_capacity is not None:
+            self._evict_overwritten_samples()
 
     def add_multi_samples(
-        self, trial_obs: list, trial_act: list, trial_adv: list, trial_val: list, trial_log_prob: list
+        self,
+        trial_obs: torch.Tensor,
+        trial_act: torch.Tensor,
+        trial_adv: torch.Tensor,
+        trial_val: torch.Tensor,
+        trial_log_prob: torch.Tensor,
     ) -> None:
-        for obs, act, adv, val, log_prob in zip(trial_obs, trial_act, trial_adv, trial_val, trial_log_prob):
-            self.add(observation=obs, action=act, adv=adv, value=val, log_prob=log_prob)
-
+        """Add a whole rollout, each field is written with at most two slice copies"""
+        num_samples = trial_obs.size(dim=0)
+        if num_samples > self.capacity:
+            # Only the most recent samples would be kept anyway
+            skipped = num_samples - self.capacity
+            trial_obs, trial_act, trial_adv, trial_val, trial_log_prob = (
+                field[skipped:] for field in (trial_obs, trial_act, trial_adv, trial_val, trial_log_prob)
+            )
+            self._ptr = (self._ptr + skipped) % self.capacity
+            self.num_total += skipped
+            num_samples = self.capacity
+
+        if self.plane_capacity is None:
+            self._write_slice(self.observations, trial_obs.reshape(num_samples, *self.observation_shape), self._ptr)
+        else:
+            self._add_planes(trial_obs.reshape(num_samples, *self.observation_shape))
+        for storage, field in (
+            (self.actions, trial_act),
+            (self.advs, trial_adv),
+            (self.values, trial_val),
+            (self.log_probs, trial_log_prob),
+        ):
+            self._write_slice(storage, field.reshape(num_samples, *storage.shape[1:]), self._ptr)
+
+        self._ptr = (self._ptr + num_samples) % self.capacity
+        self.num_total += num_samples
         self.count += 1
+        if self.plane_capacity is not None:
+            self._evict_overwritten_samples()
+
+    def _write_slice(self, storage: torch.Tensor, values: torch.Tensor, ptr: int) -> None:
+        """Copy values to the circular storage starting at the given position, wrapping around at the end"""
+        first_len = min(values.size(dim=0), storage.size(dim=0) - ptr)
+        storage[ptr : ptr + first_len] = values[:first_len]
+        storage[: values.size(dim=0) - first_len] = values[first_len:]
+
+    def _add_planes(self, observations: torch.Tensor) -> None:
+        """Store the distinct planes of observations, all from the same trial, to be added at the current position"""
+        # Planes are deduplicated by content, whatever the stacking order of the frames
+        (num_samples, num_planes, *plane_shape) = observations.shape
+        (unique_planes, inverse) = self._unique_planes(observations.reshape(num_samples * num_planes, -1))
+        num_unique_planes = unique_planes.size(dim=0)
+        if num_unique_planes > self.plane_capacity:
+            raise ValueError(
+                f"Unable to store [{num_unique_planes}] distinct observation planes, plane capacity is [{self.plane_capacity}]"
+            )
+
+        self._write_slice(self.planes, unique_planes.reshape(num_unique_planes, *plane_shape), self._plane_ptr)
+        plane_positions = (self._plane_ptr + torch.arange(num_unique_planes)) % self.plane_capacity
+        inverse = inverse.reshape(num_samples, num_planes)
+        self._write_slice(self.plane_indices, plane_positions[inverse], self._ptr)
+        self._write_slice(self.oldest_plane_serials, self.num_planes_total + inverse.min(dim=1).values, self._ptr)
+
+        self._plane_ptr = (self._plane_ptr + num_unique_planes) % self.plane_capacity
+        self.num_planes_total += num_unique_planes
+
+    def _unique_planes(self, planes: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Distinct flattened planes and the index of the distinct plane of each plane
+
+        Planes are grouped by hash, sorting the planes themselves is only done on hash collisions.
+        """
+        if self._plane_hash_weights is None:
+            return torch.unique(planes, dim=0, return_inverse=True)
+        words = planes.contiguous().view(torch.int64)
+        (unique_hashes, inverse) = torch.unique((words * self._plane_hash_weights).sum(dim=1), return_inverse=True)
+        # Any plane of each group can represent it
+        representatives = torch.empty_like(unique_hashes).scatter_(0, inverse, torch.arange(planes.size(dim=0)))
+        if not torch.equal(words.index_select(0, representatives).index_select(0, inverse), words):
+            return torch.unique(planes, dim=0, return_inverse=True)
+        return (planes.index_select(0, representatives), inverse)
+
+    def _evict_overwritten_samples(self) -> None:
+        """Evict the samples, up to the newest one, referencing planes that have been overwritten"""
+        size = self.size()
+        positions = (self._ptr - size + torch.arange(size)) % self.capacity
+        overwritten = torch.nonzero(
+            self.oldest_plane_serials[positions] < self.num_planes_total - self.plane_capacity
+        )
+        if overwritten.size(dim=0) > 0:
+            self._first_sample_serial = self.num_total - size + int(overwritten[-1]) + 1
+
+    def _observations(self, positions: torch.Tensor) -> torch.Tensor:
+        if self.plane_capacity is None:
+            return self.observations[positions]
+        return self.planes[self.plane_indices[positions]]
 
     def sample(self, num) -> APPODataBufferSample:
         np.random.seed(self.seed + self.count)
         size = self.size()
         if size < num:
-            indices = range(size)
+            indices = np.arange(size)
         else:
-            indices = np.random.choice(self.size(), size=num, replace=False)
+            indices = np.random.choice(size, size=num, replace=False)
+        # Samples are indexed from the oldest one still in the buffer
+        positions = torch.from_numpy((self._ptr - size + indices) % self.capacity)
 
         return APPODataBufferSample(
-            observation=self.observations[indices].clone().to(self.device),
-            action=self.actions[indices].clone().to(self.device),
-            adv=self.advs[indices].clone().to(self.device),
-            value=self.values[indices].clone().to(self.device),
-            log_prob=self.log_probs[indices].clone().to(self.device),
+            observation=self._observations(positions).to(self.device),
+            action=self.actions[positions].clone().to(self.device),
+            adv=self.advs[positions].clone().to(self.device),
+            value=self.values[positions].clone().to(self.device),
+            log_prob=self.log_probs[positions].clone().to(self.device),
         )
 
     def size(self):
-        return self.num_total if self.num_total < self.capacity else self.capacity
+        return min(self.num_total - self._first_sample_serial, self.capacity)
 
 class RolloutBuffer:
-    """Rollout buffer for PPO"""
+    """Rollout buffer for PPO
+
+    Observations are kept in their native uint8 form by default.
+    """
 
     def __init__(
         self,
         capacity: int,
         observation_shape: tuple,
         action_shape: tuple,
-        observation_dtype: torch.dtype = torch.float32,
+        observation_dtype: torch.dtype = torch.uint8,
         action_dtype: torch.dtype = torch.float32,
         reward_dtype: torch.dtype = torch.float32,
     ) -> None:
@@ -340,49 +518,167 @@ class RolloutBuffer:
         self._ptr = 0
         self.num_total = 0
 
-    def add(self, observation: torch.Tensor, action: torch.Tensor, reward: torch.Tensor, done: torch.Tensor, value: torch.Tensor,log_prob: torch.Tensor) -> None:
-        """Add samples to rollout buffer"""
+    def add(
+        self,
+        observation: torch.Tensor,
+        action: torch.Tensor,
+        reward: torch.Tensor,
+        done: torch.Tensor,
+        value: Union[torch.Tensor, None] = None,
+        log_prob: Union[torch.Tensor, None] = None,
+    ) -> None:
+        """Add samples to rollout buffer, value and log prob can be left out and filled later on"""
         if self.num_total < self.capacity:
             self.observations[self._ptr] = observation
             self.actions[self._ptr] = action
             self.rewards[self._ptr] = reward
             self.dones[self._ptr] = done
-            self.values[self._ptr] = value
-            self.log_probs[self._ptr] = log_prob
+            if value is not None:
+                self.values[self._ptr] = value
+            if log_prob is not None:
+                self.log_probs[self._ptr] = log_prob
             self._ptr = (self._ptr + 1) % self.capacity
             self.num_total += 1
 
     def reset(self) -> None:
-        """Reset the rollout"""
-        self.observations = torch.zeros((self.capacity, *self.observation_shape), dtype=self.observation_dtype)
-        self.actions = torch.zeros((self.capacity, *self.action_shape), dtype=self.action_dtype)
-        self.rewards = torch.zeros((self.capacity,), dtype=self.reward_dtype)
-        self.dones = torch.zeros((self.capacity,), dtype=torch.float32)
+        """Reset the rollout
+
+        Storage is reused, only the small per step tensors are zeroed, stale observations & actions past `num_total`
+        are never read.
+        """
+        self.rewards.zero_()
+        self.dones.zero_()
+        self.values.zero_()
+        self.log_probs.zero_()
         self._ptr = 0
         self.num_total = 0
 
-def serialize_model(model: APPOModel):
-    model.network.to(torch.device("cpu"))
-    stream = io.BytesIO()
-    torch.save(model.network, stream)
+class RolloutBufferPool:
+    """Pool of rollout buffers shared by the trial callbacks
 
-    return stream.getvalue()
+    Buffers are allocated when no released one is available and reused afterward.
+    """
 
+    def __init__(self, **rollout_buffer_kwargs) -> None:
+        self._rollout_buffer_kwargs = rollout_buffer_kwargs
+        self._available_buffers = []
+        self.num_allocated = 0
 
-def deserialize_eval_model(serial_data):
-    stream = io.BytesIO(serial_data)  # or stream.write(serial_data)
-    network = torch.load(stream, map_location=torch.device("cpu"))
-    network.eval()
+    def acquire(self) -> RolloutBuffer:
+        if len(self._available_buffers) > 0:
+            return self._available_buffers.pop()
+        self.num_allocated += 1
+        return RolloutBuffer(**self._rollout_buffer_kwargs)
 
-    model = APPOModel(network)
-    return model
+    def release(self, rollout_buffer: RolloutBuffer) -> None:
+        rollout_buffer.reset()
+        self._available_buffers.append(rollout_buffer)
+
+# Flat weights format: magic, version & header size, JSON header describing the tensors, then the tensors blob
+WEIGHTS_MAGIC = b"APPO"
+WEIGHTS_FORMAT_VERSION = 1
+_WEIGHTS_PREFIX = struct.Struct("<4sII")
+_WEIGHTS_ALIGNMENT = 64  # Every tensor starts at an aligned offset, allowing to view it in place with its own dtype
+
+
+def _align(offset: int) -> int:
+    return -(-offset // _WEIGHTS_ALIGNMENT) * _WEIGHTS_ALIGNMENT
 
-def deserialize_training_model(serial_data):
-    stream = io.BytesIO(serial_data)  # or stream.write(serial_data)
-    network = torch.load(stream, map_location=torch.device("cpu"))
-    network.train()
 
-    model = APPOModel(network)
-    return model
+def _read_weights_header(serial_data) -> Tuple[dict, int]:
+    """Parse the header of serialized weights, returns it along with the offset of the tensors blob"""
+    (magic, version, header_size) = _WEIGHTS_PREFIX.unpack_from(serial_data, 0)
+    if magic != WEIGHTS_MAGIC:
+        raise ValueError("Serialized data are not in the weights format")
+    if version != WEIGHTS_FORMAT_VERSION:
+        raise ValueError(f"Unsupported weights format version [{version}], expected [{WEIGHTS_FORMAT_VERSION}]")
+    header = json.loads(bytes(serial_data[_WEIGHTS_PREFIX.size : _WEIGHTS_PREFIX.size + header_size]))
+    return (header, _align(_WEIGHTS_PREFIX.size + header_size))
 
 
+def serialize_model(model: APPOModel):
+    """Serialize the network weights in the flat weights format, the network is left on its device"""
+    return serialize_state_dict(model.network.state_dict(), model.network.num_actions)
+
+
+def serialize_state_dict(state_dict: dict, num_actions: int):
+    """Serialize the weights of a `PolicyValueNetwork`, e.g. a snapshot of them, in the flat weights format"""
+    tensors = []
+    blob_size = 0
+    for (name, tensor) in state_dict.items():
+        num_bytes = tensor.numel() * tensor.element_size()
+        tensors.append([name, str(tensor.dtype).removeprefix("torch."), list(tensor.shape), blob_size, num_bytes])
+        blob_size = _align(blob_size + num_bytes)
+    header = json.dumps({"num_actions": num_actions, "tensors": tensors}).encode()
+    blob_offset = _align(_WEIGHTS_PREFIX.size + len(header))
+
+    # The serialized data is assembled with a single copy of the weights
+    chunks = [_WEIGHTS_PREFIX.pack(WEIGHTS_MAGIC, WEIGHTS_FORMAT_VERSION, len(header)), header]
+    size = _WEIGHTS_PREFIX.size + len(header)
+    for ((_, tensor), (_, _, _, offset, num_bytes)) in zip(state_dict.items(), tensors):
+        chunks.append(bytes(blob_offset + offset - size))
+        chunks.append(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy())
+        size = blob_offset + offset + num_bytes
+    chunks.append(bytes(blob_offset + blob_size - size))
+
+    return b"".join(chunks)
+
+
+def is_weights_format(serial_data) -> bool:
+    """Whether serialized data are in the flat weights format, rather than a pickled network"""
+    return bytes(serial_data[: len(WEIGHTS_MAGIC)]) == WEIGHTS_MAGIC
+
+
+def load_weights(network: torch.nn.Module, serial_data) -> None:
+    """Copy weights serialized by `serialize_model` in place to a network having the same architecture
+
+    `serial_data` can be any buffer, e.g. bytes or a memory mapped file.
+    """
+    (header, blob_offset) = _read_weights_header(serial_data)
+    state_dict = network.state_dict()
+    with warnings.catch_warnings():
+        # The serialized weights are only ever read
+        warnings.simplefilter("ignore", UserWarning)
+        blob = torch.frombuffer(serial_data, dtype=torch.uint8)
+    with torch.no_grad():
+        for (name, dtype, shape, offset, num_bytes) in header["tensors"]:
+            if name not in state_dict or list(state_dict[name].shape) != shape:
+                raise ValueError(f"Serialized tensor [{name}] of shape [{shape}] doesn't match the network")
+            start = blob_offset + offset
+            state_dict[name].copy_(blob[start : start + num_bytes].view(getattr(torch, dtype)).view(shape))
+    del blob
+
+
+def save_weights_file(model: APPOModel, path: str) -> None:
+    with open(path, "wb") as file:
+        file.write(serialize_model(model))
+
+
+def load_weights_file(network: torch.nn.Module, path: str) -> None:
+    """Load weights saved with `save_weights_file` in place, reading them from a memory mapped file"""
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+        load_weights(network, mapped_file)
+
+
+def _deserialize_model(serial_data, training: bool) -> APPOModel:
+    if not is_weights_format(serial_data):
+        # Pickled network, as serialized before the weights format existed
+        network = torch.load(io.BytesIO(serial_data), map_location=torch.device("cpu"))
+    else:
+        (header, _) = _read_weights_header(serial_data)
+        # The network is allocated without initializing its weights, they are all loaded right away
+        with torch.device("meta"):
+            network = PolicyValueNetwork(num_actions=header["num_actions"])
+        network = network.to_empty(device=torch.device("cpu"))
+        load_weights(network, serial_data)
+    network.train(training)
+
+    # Evaluation models don't need an optimizer
+    return APPOModel(network, with_optimizer=training)
+
+
+def deserialize_eval_model(serial_data):
+    return _deserialize_model(serial_data, training=False)
+
+def deserialize_training_model(serial_data):
+    return _deserialize_model(serial_data, training=True)
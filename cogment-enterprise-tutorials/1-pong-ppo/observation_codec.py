@@ -0,0 +1,46 @@
+# Copyright 2023 AI Redefined Inc. <dev+cogment@ai-r.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import warnings
+import zlib
+from typing import Union
+
+import torch
+
+from data_pb2 import CHW, ZLIB
+from environment import PONG_OBSERVATION_SHAPE
+
+
+def decode_observation(observation, out: Union[torch.Tensor, None] = None) -> torch.Tensor:
+    """Decode the bytes of an `Observation` to a uint8 CHW tensor, matching the CNN input shape (see model.py)
+
+    Without `out`, the returned tensor is a view of the observation bytes, nothing is copied beside the
+    decompression of compressed observations. Otherwise the observation is copied once into `out`, e.g. a slot of a
+    preallocated buffer, which is returned. This copy is a plain contiguous one for observations sent in the CHW
+    layout.
+    """
+    value = observation.value
+    if observation.encoding == ZLIB:
+        value = zlib.decompress(value)
+    with warnings.catch_warnings():
+        # Decoded observations are views of the received, immutable, bytes and are never written to
+        warnings.filterwarnings("ignore", message="The given buffer is not writable", category=UserWarning)
+        obs = torch.frombuffer(value, dtype=torch.uint8)
+    if observation.layout == CHW:
+        obs = obs.view(PONG_OBSERVATION_SHAPE[::-1])
+    else:
+        obs = obs.view(PONG_OBSERVATION_SHAPE).permute((2, 0, 1))
+    if out is None:
+        return obs
+    return out.copy_(obs)
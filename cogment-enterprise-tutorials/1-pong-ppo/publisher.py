@@ -0,0 +1,116 @@
+# Copyright 2023 AI Redefined Inc. <dev+cogment@ai-r.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+import model as bench_model
+
+
+class ModelPublisher:
+    """Publish the trained model to the model registry in the background
+
+    Training steps submit a snapshot of the weights, taken on the training device, and return right away. Submissions
+    are coalesced, only the latest one is published once either `min_publish_interval` seconds elapsed since the
+    previous publication or `max_unpublished_updates` updates have been submitted in the meantime. Submissions to be
+    stored are never skipped nor coalesced, they are stored in order right away and supersede older pending
+    publications. The serialization runs in a worker thread and the registry calls in a dedicated task.
+    """
+
+    def __init__(self, model_name, min_publish_interval=1.0, max_unpublished_updates=10):
+        self.model_name = model_name
+        self.min_publish_interval = min_publish_interval
+        self.max_unpublished_updates = max_unpublished_updates
+        self._registry = None
+        self._pending = None  # (update index, weights snapshot, number of actions, None)
+        self._pending_stores = deque()  # (update index, weights snapshot, number of actions, store metadata)
+        self._wakeup = None
+        self._idle = None
+        self._task = None
+        self._last_publish_time = float("-inf")
+        self._last_published_update_index = 0
+        self.model_iteration_info = None
+        self.published_count = 0
+        self.coalesced_count = 0
+
+    def submit(self, registry, model, update_index, store_metadata=None):
+        """Snapshot the weights of the model to be published, they are also stored when given `store_metadata`"""
+        snapshot = {name: tensor.detach().clone() for (name, tensor) in model.network.state_dict().items()}
+        submission = (update_index, snapshot, model.network.num_actions, store_metadata)
+        if self._pending is not None:
+            # Either replaced by the new publication or superseded by the new store
+            self.coalesced_count += 1
+            self._pending = None
+        self._registry = registry
+        if store_metadata is not None:
+            self._pending_stores.append(submission)
+        else:
+            self._pending = submission
+
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._idle = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        self._idle.clear()
+        self._wakeup.set()
+
+    async def flush(self):
+        """Wait for the publication of every submitted model"""
+        if self._task is not None:
+            await self._idle.wait()
+
+    def _publish_delay(self):
+        (update_index, _, _, _) = self._pending
+        if update_index - self._last_published_update_index >= self.max_unpublished_updates:
+            return 0
+        return self._last_publish_time + self.min_publish_interval - time.monotonic()
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while len(self._pending_stores) > 0 or self._pending is not None:
+                if len(self._pending_stores) > 0:
+                    submission = self._pending_stores.popleft()
+                else:
+                    delay = self._publish_delay()
+                    if delay > 0:
+                        # Newer submissions replace the pending one in the meantime
+                        try:
+                            await asyncio.wait_for(self._wakeup.wait(), delay)
+                            self._wakeup.clear()
+                        except asyncio.TimeoutError:
+                            pass
+                        continue
+                    submission = self._pending
+                    self._pending = None
+
+                (update_index, snapshot, num_actions, store_metadata) = submission
+                try:
+                    await self._publish(snapshot, num_actions, store_metadata)
+                except Exception:
+                    logging.exception(f"Unable to publish model [{self.model_name}] update [{update_index}]")
+                self._last_publish_time = time.monotonic()
+                self._last_published_update_index = update_index
+            self._idle.set()
+
+    async def _publish(self, snapshot, num_actions, store_metadata):
+        serial_model = await asyncio.to_thread(bench_model.serialize_state_dict, snapshot, num_actions)
+        if store_metadata is not None:
+            self.model_iteration_info = await self._registry.store_model(self.model_name, serial_model, store_metadata)
+        else:
+            self.model_iteration_info = await self._registry.publish_model(self.model_name, serial_model)
+        self.published_count += 1
@@ -16,59 +16,163 @@ import asyncio
 import logging
 import functools
 import os
+from collections import OrderedDict
 
 import cogment
 import torch
-import numpy as np
 
 import cog_settings
 from data_pb2 import Action
 import model as bench_model
 from environment import PONG_OBSERVATION_SHAPE
+from observation_codec import decode_observation
+from inference import InferenceBatcher
 
 
 log = logging.getLogger(__name__)
 
 
-def tensor_from_observation(observation):
-    # Reshape observersion to match CNN input shape (see model.py)
-    return torch.unsqueeze(torch.tensor(np.frombuffer(observation.value, dtype=np.uint8), dtype=torch.float32).reshape(tuple(PONG_OBSERVATION_SHAPE)).permute((2, 0, 1)), dim=0)
-
-def action_from_tensor(action_tensor):
-    return Action(value=action_tensor.cpu().numpy()[0])
-
-async def rl_actor(model_registry, session):
+def tensor_from_observation(observation, out=None):
+    # Observation in the CNN input shape (see model.py), as a batch of one
+    if out is None:
+        return torch.unsqueeze(decode_observation(observation), dim=0)
+    return decode_observation(observation, out=out)
+
+class ModelCache:
+    """Process wide cache of the models used by the actor sessions
+
+    The latest iteration of each model is tracked once for all the sessions, each iteration is thus deserialized once.
+    Iterations are kept as long as a session uses them, the unused ones are evicted in least recently used order beyond
+    `max_unused_models`. Evicted models are recycled, the weights of the following iterations are loaded in place in
+    their networks instead of allocating new ones.
+    """
+
+    def __init__(self, model_registry, max_unused_models=2):
+        self._model_registry = model_registry
+        self._max_unused_models = max_unused_models
+        self._latest_models = {}
+        self._models = OrderedDict()  # (model name, iteration) -> model, in least recently used order
+        self._ref_counts = {}
+        self._recycled_models = {}  # model name -> evicted models
+        self.hits_count = 0
+        self.misses_count = 0
+        self.recycled_count = 0
+
+    async def _latest_model(self, model_name):
+        if model_name not in self._latest_models:
+            # Stored as a task so that concurrent sessions share the same tracking
+            self._latest_models[model_name] = asyncio.ensure_future(
+                # Serialized models are deserialized by the cache itself, only once per iteration
+                self._model_registry.track_latest_model(model_name, lambda serial_data: serial_data, 30)
+            )
+        latest_model_task = self._latest_models[model_name]
+        try:
+            # Shielded so that a cancelled session does not cancel the tracking shared with the other ones
+            return await asyncio.shield(latest_model_task)
+        finally:
+            # Failed tracking is retried by the next call
+            if latest_model_task.done() and (latest_model_task.cancelled() or latest_model_task.exception() is not None):
+                if self._latest_models.get(model_name) is latest_model_task:
+                    del self._latest_models[model_name]
+
+    async def wait_for_available(self, model_name):
+        latest_model = await self._latest_model(model_name)
+        await latest_model.wait_for_available()
+
+    async def get(self, model_name, used_iteration_info=None):
+        """Retrieve the latest iteration of a model, releasing the one used so far if it changed"""
+        latest_model = await self._latest_model(model_name)
+        (serial_data, model_iteration_info) = await latest_model.get()
+        key = (model_name, model_iteration_info.iteration)
+        if key in self._models:
+            self.hits_count += 1
+            model = self._models[key]
+            self._models.move_to_end(key)
+        else:
+            self.misses_count += 1
+            model = self._deserialize(model_name, serial_data)
+            self._models[key] = model
+            self._ref_counts[key] = 0
+
+        if used_iteration_info is None or used_iteration_info.iteration != model_iteration_info.iteration:
+            self._ref_counts[key] += 1
+            if used_iteration_info is not None:
+                self.release(model_name, used_iteration_info)
+        self._evict()
+        return (model, model_iteration_info)
+
+    def release(self, model_name, model_iteration_info):
+        """Mark a model iteration as no longer used by a session"""
+        self._ref_counts[(model_name, model_iteration_info.iteration)] -= 1
+        self._evict()
+
+    def _deserialize(self, model_name, serial_data):
+        recycled_models = self._recycled_models.get(model_name, [])
+        if recycled_models and bench_model.is_weights_format(serial_data):
+            model = recycled_models.pop()
+            try:
+                bench_model.load_weights(model.network, serial_data)
+                self.recycled_count += 1
+                return model
+            except ValueError:
+                # e.g. a different number of actions, the network is rebuilt from scratch
+                pass
+        return bench_model.deserialize_eval_model(serial_data)
+
+    def _evict(self):
+        unused_keys = [key for key in self._models if self._ref_counts[key] == 0]
+        for key in unused_keys[: max(len(unused_keys) - self._max_unused_models, 0)]:
+            # No session uses the model anymore, its weights can be overwritten
+            recycled_models = self._recycled_models.setdefault(key[0], [])
+            if len(recycled_models) < self._max_unused_models:
+                recycled_models.append(self._models[key])
+            del self._models[key]
+            del self._ref_counts[key]
+
+
+async def rl_actor(model_cache, inference_batcher, session):
     model_name = session.config.model_name
 
-    latest_model = await model_registry.track_latest_model(model_name, bench_model.deserialize_eval_model, 30)
-    await latest_model.wait_for_available()
+    await model_cache.wait_for_available(model_name)
 
     session.start()
     logging.info(f"Trial [{session.get_trial_id()}] started")
 
+    # Observations are decoded in place, the network takes care of their normalization
+    obs_tensor = torch.zeros((1, *PONG_OBSERVATION_SHAPE[::-1]), dtype=torch.uint8)
     step_count = 0
-    async for event in session.all_events():
-        if event.observation:
-            obs_tensor = tensor_from_observation(event.observation.observation)
-            if event.type != cogment.EventType.ACTIVE:
-                continue
-            step_count += 1
+    model_iteration_info = None
+    inference_batcher.add_session()
+    try:
+        async for event in session.all_events():
+            if event.observation:
+                tensor_from_observation(event.observation.observation, out=obs_tensor)
+                if event.type != cogment.EventType.ACTIVE:
+                    continue
+                step_count += 1
 
-            model, model_iteration_info = await latest_model.get()
-            with torch.no_grad():
-                dist = model.network.get_action(obs_tensor.to(model.device))
-                action = action_from_tensor(dist.sample())
+                model, model_iteration_info = await model_cache.get(model_name, model_iteration_info)
+                action_value = await inference_batcher.action(model, obs_tensor)
 
-            session.do_action(action)
+                session.do_action(Action(value=action_value))
+    finally:
+        inference_batcher.remove_session()
+        if model_iteration_info is not None:
+            model_cache.release(model_name, model_iteration_info)
 
-    logging.info(f"Trial [{session.get_trial_id()}] ended: \n\t- [{step_count}] steps taken, \n\t- last model iteration used [{model_iteration_info.iteration}]")
+    last_iteration = model_iteration_info.iteration if model_iteration_info is not None else None
+    logging.info(f"Trial [{session.get_trial_id()}] ended: \n\t- [{step_count}] steps taken, \n\t- last model iteration used [{last_iteration}], \n\t- model cache hits [{model_cache.hits_count}], misses [{model_cache.misses_count}], recycled [{model_cache.recycled_count}]")
 
 
 async def main():
     context = cogment.Context(cog_settings=cog_settings, user_id="pong")
     model_registry = await context.get_model_registry_v2()
 
-    actor_func = functools.partial(rl_actor, model_registry)
+    # Models are shared by all the actor sessions of the process
+    model_cache = ModelCache(model_registry)
+    # Actions of the concurrent sessions are computed in batches
+    inference_batcher = InferenceBatcher()
+    actor_func = functools.partial(rl_actor, model_cache, inference_batcher)
     context.register_actor(actor_func, "appo", ["player"])
 
     await context.serve_all_registered(
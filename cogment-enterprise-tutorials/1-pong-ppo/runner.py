@@ -18,20 +18,23 @@ import time
 import os
 
 import torch
-import numpy as np
 import fire
 import cogment
 import cogment_enterprise.runner as ent_run
 
 import cog_settings
 import model as bench_model
-from model import RolloutBuffer, APPODataBuffer, APPOModel
+from model import RolloutBufferPool, APPODataBuffer, APPOModel
+from observation_codec import decode_observation
+from publisher import ModelPublisher
 from environment import PONG_OBSERVATION_SHAPE, PONG_NB_PLAYERS
-from data_pb2 import AgentConfig, EnvironmentConfig
+from data_pb2 import AgentConfig, EnvironmentConfig, CHW, ZLIB
 
 
 ONE_HOUR = 3600
 MODEL_STORE_TICK_MOD = 100
+MODEL_PUBLISH_MIN_INTERVAL = 1.0  # In seconds
+MODEL_PUBLISH_MAX_UNPUBLISHED_UPDATES = 10
 PLAYER_ACTOR_NAME = "pong_player"
 MODEL_NAME = "tutorials_cnn"
 total_trial_steps = 0
@@ -44,6 +47,10 @@ async def pre_trial_callback(info):
 
     env_config = EnvironmentConfig()
     env_config.id = 0
+    # Observations are sent in the CNN input layout, sparing the actor and the trainer a permutation
+    env_config.observation_layout = CHW
+    # Observations are compressed, reducing the bytes going through the orchestrator and the datastore
+    env_config.observation_encoding = ZLIB
 
     params = cogment.TrialParameters(cog_settings)
     params.actors.append(cogment.ActorParameters(cog_settings, "player"))
@@ -109,12 +116,34 @@ class ModelTrainer:
         self.datastore = datastore
 
         # Data buffer
+        # Stacked frames are stored once when observation planes are deduplicated
+        plane_capacity = None
+        if self.rl_model.cfg.deduplicate_observation_planes:
+            plane_capacity = int(self.rl_model.cfg.buffer_size * self.rl_model.cfg.observation_planes_per_sample)
+            # A single rollout, without any duplicated plane, must fit
+            max_rollout_planes = self.rl_model.cfg.num_rollout_steps * PONG_OBSERVATION_SHAPE[-1]
+            if plane_capacity < max_rollout_planes:
+                raise ValueError(
+                    f"Observation plane capacity [{plane_capacity}] is lower than the [{max_rollout_planes}] planes of a rollout, increase `buffer_size` or `observation_planes_per_sample`"
+                )
         self.data_buffer = APPODataBuffer(
             capacity=self.rl_model.cfg.buffer_size,
             observation_shape=PONG_OBSERVATION_SHAPE[::-1],
             action_shape=(1,),
             seed=0,
-            device=self.rl_model.device
+            device=self.rl_model.device,
+            plane_capacity=plane_capacity,
+        )
+        # Rollout buffers are reused across trials
+        self.rollout_buffer_pool = RolloutBufferPool(
+            capacity=self.rl_model.cfg.num_rollout_steps,
+            observation_shape=PONG_OBSERVATION_SHAPE[::-1],
+            action_shape=(1,),
+        )
+        self.model_publisher = ModelPublisher(
+            MODEL_NAME,
+            min_publish_interval=MODEL_PUBLISH_MIN_INTERVAL,
+            max_unpublished_updates=MODEL_PUBLISH_MAX_UNPUBLISHED_UPDATES,
         )
         self.tot_num_updates = (
             self.rl_model.cfg.max_training_steps // self.rl_model.cfg.num_rollout_steps
@@ -126,10 +155,10 @@ class ModelTrainer:
         obs = actor_data.observation
         action = actor_data.action
 
-        # Reshape observersion to match CNN input shape (see model.py)
-        obs = torch.tensor(np.frombuffer(obs.value, dtype=np.uint8), dtype=self.dtype)
+        # View of the observation bytes in the CNN input shape, copied only once added to the rollout buffer
+        # Observations are kept as uint8, the network takes care of their normalization
+        obs = torch.unsqueeze(decode_observation(obs), dim=0)
         action = torch.tensor(action.value, dtype=self.dtype)
-        obs = torch.unsqueeze(obs.reshape(PONG_OBSERVATION_SHAPE).permute((2, 0, 1)), dim=0)
         done = (
             torch.ones(1, dtype=self.dtype)
             if trial_done
@@ -163,18 +192,32 @@ class ModelTrainer:
             num_updates=update_index,
         )
 
-        # Save model
-        serial_model = bench_model.serialize_model(self.rl_model)
+        # Save model, in the background
+        store_metadata = None
         if (update_index % MODEL_STORE_TICK_MOD) == 0:
-            model_iteration_info = await registry.store_model(
-                MODEL_NAME,
-                serial_model,
-                {"step_index": str(self.step_index)},
-            )
-        else:
-            model_iteration_info = await registry.publish_model(MODEL_NAME, serial_model)
-
-        return model_iteration_info
+            store_metadata = {"step_index": str(self.step_index)}
+        self.model_publisher.submit(registry, self.rl_model, update_index, store_metadata)
+
+        # Latest published model iteration, if any
+        return self.model_publisher.model_iteration_info
+
+    def _network_device(self) -> torch.device:
+        """Device the network currently lives on, it is not necessarily the training device"""
+        return next(self.rl_model.network.parameters()).device
+
+    def _evaluate_rollout(self, rollout_buffer, num_data):
+        """Compute the values & log probs of a whole rollout, in batches of bounded size"""
+        batch_size = self.rl_model.cfg.rollout_evaluation_batch_size
+        device = self._network_device()
+        with torch.no_grad():
+            for start in range(0, num_data, batch_size):
+                end = min(start + batch_size, num_data)
+                dist, values = self.rl_model.network.get_action_and_value(
+                    rollout_buffer.observations[start:end].to(device)
+                )
+                log_probs = dist.log_prob(rollout_buffer.actions[start:end].flatten().to(device))
+                rollout_buffer.values[start:end] = values.flatten().cpu()
+                rollout_buffer.log_probs[start:end] = log_probs.cpu()
 
     async def _process_sample(self, trial_step_index, sample, rollout_buffer):
         trial_done = sample.trial_state == cogment.TrialState.ENDED
@@ -193,10 +236,15 @@ class ModelTrainer:
             if (
                 (trial_step_index + 1) % self.rl_model.cfg.num_rollout_steps > 0
             ) and not trial_done:
-                with torch.no_grad():
-                    value = self.rl_model.network.get_value(obs)
-                    dist = self.rl_model.network.get_action(obs)
-                    log_prob = dist.log_prob(action)
+                value = None
+                log_prob = None
+                if not self.rl_model.cfg.deferred_rollout_evaluation:
+                    # Value and log prob from a single evaluation of the network
+                    device = self._network_device()
+                    with torch.no_grad():
+                        dist, value = self.rl_model.network.get_action_and_value(obs.to(device))
+                        log_prob = dist.log_prob(action.to(device)).cpu()
+                        value = value.cpu()
 
                 # Add data to rollout buffer
                 rollout_buffer.add(
@@ -209,12 +257,13 @@ class ModelTrainer:
                 )
             elif rollout_buffer.num_total > 1:
                 # Either the rollout buffer is full, or we reached the end of the trial
-                curr_num_data = rollout_buffer.num_total + 1
-                next_obs = torch.unsqueeze(
-                    obs.reshape(PONG_OBSERVATION_SHAPE).permute((2, 0, 1)), dim=0
-                )
+                curr_num_data = rollout_buffer.num_total
+                if self.rl_model.cfg.deferred_rollout_evaluation:
+                    self._evaluate_rollout(rollout_buffer, curr_num_data)
+
+                # The current observation, already in the CNN input shape, is the next observation of the rollout
                 with torch.no_grad():
-                    next_value = self.rl_model.network.get_value(next_obs)
+                    next_value = self.rl_model.network.get_value(obs.to(self._network_device()))
                     next_value = next_value.squeeze(0).cpu()
 
                 # Compute GAE for APPO
@@ -260,39 +309,41 @@ class ModelTrainer:
     async def trial_callback(self, session):
         trial_step_index = 0
 
-        rollout_buffer = RolloutBuffer(
-            capacity=self.rl_model.cfg.num_rollout_steps,
-            observation_shape=PONG_OBSERVATION_SHAPE[::-1],
-            action_shape=(1,),
-        )
-        async for sample in session.all_samples():
-            # Process raw sample and add it to the rollout buffer
-            # When the buffer is full, add the full rollout to the data_buffer
-            await self._process_sample(
-                trial_step_index, sample, rollout_buffer
-            )
-
-            # Update the model if needed
-            if self._is_model_update_required():
-                self.update_index += 1
-                update_index = self.update_index
-                model_iteration_info = await self._training_step(update_index, session.model_registry)
-
-                if update_index % 50 == 0:
-                    avg_trial_rewards = torch.zeros(1, dtype=self.dtype)
-                    if len(self.trial_rewards) > 0:
-                        avg_trial_rewards = await self.rl_model.compute_average_reward(
-                            self.trial_rewards
-                        )
-
-                    logging.info(
-                        f"Step [{self.step_index}] | Model update [{update_index}] | Avg. trial reward [{avg_trial_rewards.item():.2f}] | Model iteration [{model_iteration_info.model_name}@{model_iteration_info.iteration}]"
-                    )
-
-            trial_step_index += 1
-            self.step_index += 1
+        rollout_buffer = self.rollout_buffer_pool.acquire()
+        try:
+            async for sample in session.all_samples():
+                # Process raw sample and add it to the rollout buffer
+                # When the buffer is full, add the full rollout to the data_buffer
+                await self._process_sample(
+                    trial_step_index, sample, rollout_buffer
+                )
 
+                # Update the model if needed
+                if self._is_model_update_required():
+                    self.update_index += 1
+                    update_index = self.update_index
+                    model_iteration_info = await self._training_step(update_index, session.model_registry)
+
+                    if update_index % 50 == 0:
+                        avg_trial_rewards = torch.zeros(1, dtype=self.dtype)
+                        if len(self.trial_rewards) > 0:
+                            avg_trial_rewards = await self.rl_model.compute_average_reward(
+                                self.trial_rewards
+                            )
+
+                        model_iteration = (
+                            f"{model_iteration_info.model_name}@{model_iteration_info.iteration}"
+                            if model_iteration_info is not None
+                            else "not yet published"
+                        )
+                        logging.info(
+                            f"Step [{self.step_index}] | Model update [{update_index}] | Avg. trial reward [{avg_trial_rewards.item():.2f}] | Model iteration [{model_iteration}]"
+                        )
 
+                trial_step_index += 1
+                self.step_index += 1
+        finally:
+            self.rollout_buffer_pool.release(rollout_buffer)
 
         await self.datastore.delete_trials([session.trial_id])
 
@@ -337,6 +388,7 @@ async def run_batch(nb_trials, nb_parallel_trials, wait_for_training):
         end = time.time()
         training_time = end - start
 
+        await model_trainer.model_publisher.flush()
         serial_model = bench_model.serialize_model(model_trainer.rl_model)
         iteration_info = await registry.store_model(
             MODEL_NAME, serial_model, {"batch_done": batch.id}